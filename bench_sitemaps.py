@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+import os, sys, csv, shutil, json, argparse, random, tempfile, time, datetime, filecmp, platform, subprocess
+from array import array
+from xml.sax.saxutils import escape
+import generate_sitemaps as gs
+
+# Origins that all normalize to the canonical one; --host-variants is the share of rows using them
+HOST_VARIANTS = ["http://www.leeladiamond.com", "https://leeladiamond.com", "HTTPS://WWW.LEELADIAMOND.COM",
+                 "http://leeladiamond.com", "https://www.leeladiamond.com:443", " https://www.leeladiamond.com"]
+
+def write_synthetic_feed(path, rows, columns=6, url_length=(48, 16), dup_ratio=0.1, host_variants=0.05, seed=0):
+    """
+    Deterministic merchant-feed shaped CSV: wide text columns around a single `link` column.
+    Product slugs have a gaussian length of url_length=(mean, sd) characters; `dup_ratio` of the
+    rows repeat an earlier product and `host_variants` of them use a non-canonical origin.
+    """
+    rng = random.Random(seed)
+    lengths = array("H")
+    filler = "abcdefghijklmnopqrstuvwxyz-0123456789" * 12
+    header = (["id", "title", "description", "link", "price", "availability"]
+              + [f"attr_{i}" for i in range(max(columns - 6, 0))])[:max(columns, 2)]
+    if "link" not in header:
+        header[-1] = "link"
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        for i in range(rows):
+            if lengths and rng.random() < dup_ratio:
+                n = rng.randrange(len(lengths))
+            else:
+                n = len(lengths)
+                lengths.append(min(max(int(rng.gauss(*url_length)), 1), len(filler)))
+            slug = f"{n}-{filler}"[:max(lengths[n], len(str(n)))]
+            origin = rng.choice(HOST_VARIANTS) if rng.random() < host_variants else gs.CANONICAL_ORIGIN
+            values = {"id": i, "title": f"Ring {n}", "description": "Lab grown diamond, 14k gold\nfree shipping " * 3,
+                      "link": f"{origin}/products/{slug}", "price": f"{n}.00 USD", "availability": "in stock"}
+            w.writerow([values.get(c, "x" * 12) for c in header])
+
+def timed(fn):
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    return {"count": count, "seconds": round(elapsed, 3),
+            "per_sec": round(count / elapsed) if elapsed else None}
+
+def bench_readers(csv_path, link_col, readers):
+    # parse = link column only (pyarrow counts are after in-batch unique); links = parse + normalize
+    results = {}
+    for reader in readers:
+        results[reader] = {
+            "parse": timed(lambda: sum(len(b) for b in gs.iter_link_batches(csv_path, link_col, reader=reader))),
+            "links": timed(lambda: sum(1 for _ in gs.iter_links(csv_path, link_col, reader=reader))),
+        }
+    return results
+
+def fuzz_urls(n, seed=0):
+    # Mostly canonical-looking URLs plus every shape normalize_url treats specially
+    rng = random.Random(seed)
+    schemes = ["https://", "http://", "HTTPS://", "Http://", "ftp://", "", "//", "https:/", "mailto:"]
+    hosts = ["www.leeladiamond.com", "leeladiamond.com", "shop.leeladiamond.com", "LEELADIAMOND.COM",
+             "evilleeladiamond.com", "example.com", "www.leeladiamond.com:443", "u@leeladiamond.com",
+             "xn--leeladiamond.com", "[::1]", ""]
+    alphabet = "abcXYZ019-_.~/%&=+;?#:@!$'()*,é \t\n\xa0"
+    corpus = [None, "", " ", "#", "?", "https://www.leeladiamond.com", "https://www.leeladiamond.com/a?#x"]
+    while len(corpus) < n:
+        tail = "".join(rng.choice(alphabet) for _ in range(rng.randrange(0, 24)))
+        u = rng.choice(schemes) + rng.choice(hosts) + rng.choice(["/products/", "/", "", "?"]) + tail
+        if rng.random() < 0.1:
+            u = rng.choice([" ", "\t", "\n", "\x1f"]) + u + rng.choice(["", " ", "\n", "\x85"])
+        corpus.append(u)
+    return corpus
+
+def reference_normalize(u):
+    # normalize_url without its fast path
+    u = (u or "").strip()
+    return gs._normalize_parsed(u) if u else u
+
+def bench_normalize(n):
+    # Throughput of normalize_url and each normalize_urls container (converted back to a list, as
+    # iter_feed_batches does) on a fuzzed corpus and a feed-like one. Equality with urlparse
+    # normalization is checked in tests/test_normalize.py.
+    rng = random.Random(1)
+    corpora = {
+        "fuzzed": fuzz_urls(n),
+        "feed": [(rng.choice(HOST_VARIANTS) if rng.random() < 0.05 else "https://www.leeladiamond.com")
+                 + f"/products/ring-{rng.randrange(n)}" for _ in range(n)],
+    }
+    containers = {"normalize_url": (lambda c: c, lambda c: [gs.normalize_url(u) for u in c]),
+                  "normalize_urls[list]": (list, gs.normalize_urls)}
+    try:
+        import pandas as pd
+        containers["normalize_urls[pandas]"] = (lambda c: pd.Series(c, dtype=object),
+                                                lambda b: gs.normalize_urls(b).tolist())
+    except ImportError:
+        pass
+    try:
+        import pyarrow as pa
+        containers["normalize_urls[pyarrow]"] = (lambda c: pa.array(c, type=pa.string()),
+                                                 lambda b: gs.normalize_urls(b).to_pylist())
+    except ImportError:
+        pass
+    results = {}
+    for corpus_name, corpus in corpora.items():
+        results[f"{corpus_name} urlparse"] = timed(lambda: len([reference_normalize(u) for u in corpus]))
+        for name, (make, run) in containers.items():
+            batch = make(corpus)
+            results[f"{corpus_name} {name}"] = timed(lambda: len(run(batch)))
+    return results
+
+def bench_escape(n, batch=8192):
+    # Throughput of escape_many against saxutils.escape on batches whose share of strings needing
+    # escaping ranges from none to all. Equality with saxutils.escape is checked in
+    # tests/test_escape.py.
+    rng = random.Random(3)
+    fuzzed = fuzz_urls(n, seed=3)
+    clean = [u for u in fuzzed if u and "&" not in u and "<" not in u and ">" not in u]
+    corpora = {
+        "clean": [f"https://www.leeladiamond.com/products/ring-{rng.randrange(n)}" for _ in range(n)],
+        "rare": [u if rng.random() > 0.001 else u + "?a=1&b=<2>" for u in clean],
+        "fuzzed": [u or "" for u in fuzzed],
+        "all": [u + rng.choice("&<>") for u in clean],
+    }
+    results = {}
+    for corpus_name, corpus in corpora.items():
+        cuts = [0]
+        while cuts[-1] < len(corpus):
+            cuts.append(cuts[-1] + rng.randrange(1, 2 * batch))
+        batches = [corpus[i:j] for i, j in zip(cuts, cuts[1:])]
+        results[f"{corpus_name} escape"] = timed(lambda: sum(len([escape(u) for u in b]) for b in batches))
+        results[f"{corpus_name} escape_many"] = timed(lambda: sum(len(list(gs.escape_many(b))) for b in batches))
+    return results
+
+def legacy_write_urlset_xml(file_path, urls):
+    # The original per-line writer, kept as the byte-identity and speed reference
+    today = datetime.datetime.now(datetime.UTC).date().isoformat()
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for u in urls:
+            f.write("  <url>\n")
+            f.write(f"    <loc>{escape(u)}</loc>\n")
+            f.write(f"    <lastmod>{today}</lastmod>\n")
+            f.write("    <changefreq>weekly</changefreq>\n")
+            f.write("    <priority>0.8</priority>\n")
+            f.write("  </url>\n")
+        f.write("</urlset>\n")
+
+def bench_write(tmp, parts, per_file=50000):
+    # URLs/sec writing `parts` full parts; every part must match the legacy writer byte for byte
+    rng = random.Random(2)
+    urls = [f"https://www.leeladiamond.com/products/ring-{i}" + ("?a=1&b=<2>" if i % 50 == 0 else "")
+            for i in rng.sample(range(per_file * 10), per_file)]
+    results = {}
+    for name, writer in (("legacy", legacy_write_urlset_xml), ("write_urlset_xml", gs.write_urlset_xml)):
+        def write_all():
+            for i in range(parts):
+                writer(os.path.join(tmp, f"{name}-{i}.xml"), urls)
+            return parts * len(urls)
+        results[name] = timed(write_all)
+    for i in range(parts):
+        if not filecmp.cmp(os.path.join(tmp, f"legacy-{i}.xml"),
+                           os.path.join(tmp, f"write_urlset_xml-{i}.xml"), shallow=False):
+            raise AssertionError("write_urlset_xml output differs from the legacy writer")
+    return results
+
+def parse_count(text):
+    # "100k" / "1M" / "10M" / "250000"
+    scale = {"k": 10**3, "m": 10**6}.get(text[-1:].lower(), 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def rows_timed(rows, fn):
+    # Like timed(), but throughput is against a fixed row count rather than fn's return value
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {"rows": rows, "seconds": round(elapsed, 3), "rows_per_sec": round(rows / elapsed) if elapsed else None}
+
+def bench_stages(csv_path, rows, link_col, reader, dedup_mode, per_file, outdir):
+    """
+    Per-stage timings for one feed. Each stage's input is materialized first so the stage is
+    timed alone; rows/sec is feed rows for the ingest stages and URLs (or parts) for the writers.
+    """
+    results = {"iter_links": rows_timed(rows, lambda: sum(1 for _ in gs.iter_links(csv_path, link_col,
+                                                                                    reader=reader)))}
+    # normalize_url alone, over the raw link strings as the stdlib reader returns them
+    raw = [u for b in gs.iter_link_batches(csv_path, link_col) for u in b]
+    results["normalize_url"] = rows_timed(len(raw), lambda: [gs.normalize_url(u) for u in raw])
+    del raw
+
+    # The dedup loop in main(): new_indices per parsed batch, rolling parts over at per_file
+    batches = list(gs.iter_url_batches(csv_path, link_col, reader=reader))
+    parts = []
+    def dedup_loop():
+        dedup, buffer = gs.make_dedup(dedup_mode, spill_dir=outdir), []
+        for urls in batches:
+            for i in dedup.new_indices(urls):
+                buffer.append(urls[i])
+                if len(buffer) >= per_file:
+                    parts.append(buffer)
+                    buffer = []
+        if buffer:
+            parts.append(buffer)
+        dedup.close()
+    results["dedup"] = rows_timed(rows, dedup_loop)
+    del batches
+
+    names = [gs.part_filename("bench-", i + 1) for i in range(len(parts))]
+    def write_parts():
+        for name, urls in zip(names, parts):
+            gs.write_urlset_xml(os.path.join(outdir, name), urls)
+    results["write_urlset_xml"] = rows_timed(sum(len(p) for p in parts), write_parts)
+    results["write_index_xml"] = rows_timed(len(names), lambda: gs.write_index_xml(
+        os.path.join(outdir, "bench-index.xml"), names, "https://www.leeladiamond.com/sitemaps"))
+    return results
+
+def run_measured(argv):
+    # Stdout, wall time and peak RSS (MiB; ru_maxrss is KiB on Linux) of one child process
+    start = time.perf_counter()
+    proc = subprocess.Popen(argv, stdout=subprocess.PIPE)
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    proc.stdout.close()
+    if proc.returncode:
+        raise RuntimeError(f"{argv[1]} exited with {proc.returncode}")
+    return out, time.perf_counter() - start, round(usage.ru_maxrss / 1024, 1)
+
+def bench_size(csv_path, rows, args, tmp):
+    # Stages in a child process (so peak RSS is per size), then generate_sitemaps.py end to end
+    out, _, stage_rss = run_measured([sys.executable, os.path.abspath(__file__), "--stages-child", csv_path,
+                                      "--rows", str(rows), "--link-column", args.link_column, "--reader", args.reader,
+                                      "--dedup", args.dedup, "--per-file", str(args.per_file)])
+    result = {"rows": rows, "feed_bytes": os.path.getsize(csv_path), "stages": json.loads(out),
+              "stages_peak_rss_mb": stage_rss}
+    result["end_to_end"] = end_to_end(csv_path, rows, args, args.dedup, os.path.join(tmp, f"out-{rows}"))
+    return result
+
+def end_to_end(csv_path, rows, args, dedup, outdir):
+    # One generate_sitemaps.py run: wall time and peak RSS
+    here = os.path.dirname(os.path.abspath(__file__))
+    _, seconds, rss = run_measured([sys.executable, os.path.join(here, "generate_sitemaps.py"), "--csv", csv_path,
+                                    "--outdir", outdir, "--link-column", args.link_column, "--reader", args.reader,
+                                    "--dedup", dedup, "--per-file", str(args.per_file),
+                                    "--public-base-url", "https://www.leeladiamond.com/sitemaps"])
+    shutil.rmtree(outdir, ignore_errors=True)
+    return {"seconds": round(seconds, 3), "rows_per_sec": round(rows / seconds), "peak_rss_mb": rss}
+
+def bench_dedup_rss(rows, args, tmp):
+    # Peak RSS of end-to-end runs per dedup mode on one large synthetic feed: where the memory
+    # ceiling of each mode actually is (the set grows with the catalogue, the hash tables far less)
+    csv_path = os.path.join(tmp, f"feed-rss-{rows}.csv")
+    mean, sd = (float(x) for x in args.url_length.split(":"))
+    write_synthetic_feed(csv_path, rows, args.columns, (mean, sd), args.dup_ratio, args.host_variants)
+    try:
+        return {mode: end_to_end(csv_path, rows, args, mode, os.path.join(tmp, f"out-rss-{mode}"))
+                for mode in args.rss_dedup.split(",") if mode}
+    finally:
+        os.remove(csv_path)
+
+def bench_startup(runs):
+    # Cold CLI startup: `-m` so the script's cached bytecode is used, as in CI. Best of `runs` in ms.
+    here = os.path.dirname(os.path.abspath(__file__))
+    help_ms, import_ms = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "generate_sitemaps", "--help"], cwd=here,
+                       stdout=subprocess.DEVNULL, check=True)
+        help_ms.append((time.perf_counter() - start) * 1000)
+        err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import generate_sitemaps"], cwd=here,
+                             stderr=subprocess.PIPE, text=True, check=True).stderr
+        # Last line is the module itself: "import time: self | cumulative | name" in microseconds
+        import_ms.append(int(err.strip().splitlines()[-1].split("|")[1]) / 1000)
+    return {"help_ms": round(min(help_ms), 1), "import_ms": round(min(import_ms), 1), "runs": runs}
+
+def count_rows(csv_path, link_col):
+    return sum(len(b) for b in gs.iter_link_batches(csv_path, link_col))
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmark generate_sitemaps.py stages")
+    p.add_argument("--csv", help="Existing feed to benchmark (default: synthetic feeds of each --sizes)")
+    p.add_argument("--sizes", default="100k,1M,10M", help="Comma-separated synthetic feed row counts")
+    p.add_argument("--columns", type=int, default=6, help="Columns in the synthetic feed")
+    p.add_argument("--url-length", default="48:16", help="Product slug length as MEAN:SD characters")
+    p.add_argument("--dup-ratio", type=float, default=0.1, help="Share of rows repeating an earlier product")
+    p.add_argument("--host-variants", type=float, default=0.05,
+                   help="Share of rows using a non-canonical origin (http, bare host, upper case, ...)")
+    p.add_argument("--link-column", default="link", help="CSV column containing URLs")
+    p.add_argument("--reader", default="csv", choices=gs.READERS, help="Reader for the stage/end-to-end runs")
+    p.add_argument("--dedup", default="set", choices=gs.DEDUP_MODES, help="Dedup for the stage/end-to-end runs")
+    p.add_argument("--per-file", type=int, default=50000, help="URLs per sitemap part")
+    p.add_argument("--json", default="bench-results.json", help="Where to write the machine-readable results")
+    p.add_argument("--readers", default=",".join(gs.READERS), help="Comma-separated reader backends to compare")
+    p.add_argument("--fuzz", type=int, default=200000,
+                   help="URLs in the normalize_urls and escape_many benchmark corpora")
+    p.add_argument("--write-parts", type=int, default=5, help="50k-URL parts written in the XML benchmark")
+    p.add_argument("--startup-runs", type=int, default=10, help="Runs of the CLI startup check (best is kept)")
+    p.add_argument("--startup-budget", type=float, default=100,
+                   help="Fail (exit 1) if `python -m generate_sitemaps --help` takes longer than this many ms")
+    p.add_argument("--startup-only", action="store_true", help="Only run the CLI startup check")
+    p.add_argument("--rss-rows", default="20M", help="Synthetic feed rows for the per-dedup-mode peak RSS runs (0 to skip)")
+    p.add_argument("--rss-dedup", default="set,hash64,hash128,disk", help="Comma-separated dedup modes for the RSS runs")
+    p.add_argument("--rows", type=int, help=argparse.SUPPRESS)
+    p.add_argument("--stages-child", metavar="CSV", help=argparse.SUPPRESS)
+    args = p.parse_args()
+
+    if args.stages_child:
+        # Child of bench_size: stage timings as JSON on stdout
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(bench_stages(args.stages_child, args.rows, args.link_column, args.reader,
+                                          args.dedup, args.per_file, tmp)))
+        return
+
+    startup = bench_startup(args.startup_runs)
+    print(f"CLI startup: --help {startup['help_ms']} ms, import {startup['import_ms']} ms "
+          f"(budget {args.startup_budget:g} ms)")
+    over_budget = startup["help_ms"] > args.startup_budget
+    if args.startup_only:
+        sys.exit(over_budget)
+
+    mean, sd = (float(x) for x in args.url_length.split(":"))
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "config": {k: v for k, v in vars(args).items() if k not in ("rows", "stages_child", "startup_only", "json")},
+              "startup": startup, "sizes": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        feeds = []
+        if args.csv:
+            feeds.append((args.csv, count_rows(args.csv, args.link_column)))
+        for rows in ([] if args.csv else [parse_count(x) for x in args.sizes.split(",") if x]):
+            csv_path = os.path.join(tmp, f"feed-{rows}.csv")
+            write_synthetic_feed(csv_path, rows, args.columns, (mean, sd), args.dup_ratio, args.host_variants)
+            feeds.append((csv_path, rows))
+        for csv_path, rows in feeds:
+            r = report["sizes"][str(rows)] = bench_size(csv_path, rows, args, tmp)
+            for stage, t in r["stages"].items():
+                print(f"{rows:>9} {stage:>16}: {t['seconds']:.3f}s ({t['rows_per_sec']} rows/sec)")
+            e = r["end_to_end"]
+            print(f"{rows:>9} {'end to end':>16}: {e['seconds']:.3f}s ({e['rows_per_sec']} rows/sec), "
+                  f"peak RSS {e['peak_rss_mb']} MiB (stages {r['stages_peak_rss_mb']} MiB)")
+            if csv_path != args.csv:
+                os.remove(csv_path)
+
+        rss_rows = parse_count(args.rss_rows)
+        if rss_rows:
+            report["dedup_rss"] = bench_dedup_rss(rss_rows, args, tmp)
+            for mode, e in report["dedup_rss"].items():
+                print(f"{rss_rows:>9} {'dedup ' + mode:>16}: {e['seconds']:.3f}s ({e['rows_per_sec']} rows/sec), "
+                      f"peak RSS {e['peak_rss_mb']} MiB")
+
+        # Reader comparison on the smallest feed
+        csv_path = args.csv or os.path.join(tmp, "feed.csv")
+        if not args.csv:
+            write_synthetic_feed(csv_path, min(rows for _, rows in feeds), args.columns, (mean, sd),
+                                 args.dup_ratio, args.host_variants)
+        readers = [r for r in args.readers.split(",") if r]
+        report["readers"] = bench_readers(csv_path, args.link_column, readers)
+        for reader, stages in report["readers"].items():
+            for stage, r in stages.items():
+                print(f"{reader:>8} {stage:>6}: {r['count']} values in {r['seconds']:.3f}s ({r['per_sec']}/sec)")
+    report["normalize"] = bench_normalize(args.fuzz)
+    for name, r in report["normalize"].items():
+        print(f"{name:>31}: {r['count']} urls in {r['seconds']:.3f}s ({r['per_sec']}/sec)")
+    print(f"normalize_url fast path stats: {gs.normalize_stats()}")
+    report["escape"] = bench_escape(args.fuzz)
+    for name, r in report["escape"].items():
+        print(f"{name:>31}: {r['count']} strings in {r['seconds']:.3f}s ({r['per_sec']}/sec)")
+    with tempfile.TemporaryDirectory() as tmp:
+        report["write"] = bench_write(tmp, args.write_parts)
+        for name, r in report["write"].items():
+            print(f"{name:>31}: {r['count']} urls in {r['seconds']:.3f}s ({r['per_sec']} urls/sec)")
+    print("write_urlset_xml output byte-identical to the legacy writer")
+    with open(args.json, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.json}")
+    if over_budget:
+        sys.exit(f"CLI startup {startup['help_ms']} ms exceeds the {args.startup_budget:g} ms budget")
+
+if __name__ == "__main__":
+    main()
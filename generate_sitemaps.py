@@ -1,8 +1,31 @@
 #!/usr/bin/env python3
-import os, argparse, datetime
-import pandas as pd
-from urllib.parse import urlparse, urlunparse
-from xml.sax.saxutils import escape
+import os, sys, io, re, csv, gzip, json, time, queue, base64, argparse, datetime, functools, hashlib
+import mmap, shutil, threading
+from array import array
+from collections import defaultdict, deque
+from urllib.parse import quote, urlparse, urlunparse
+# asyncio, concurrent.futures, tempfile and urllib.request (plus pandas/pyarrow/numpy) are imported
+# where used: together they are most of the startup cost of a small run or --help
+
+CANONICAL_ORIGIN = "https://www.leeladiamond.com"
+
+# scheme://host + printable-ASCII path/query (+ ignored fragment). For these urlparse/urlunparse
+# is a no-op apart from the origin, so normalize_url can skip it. Whitespace, ';' params,
+# empty '?', ports, userinfo and non-ASCII stay on the urlparse path.
+_SIMPLE_URL_RE = re.compile(
+    r"(?s)([A-Za-z][A-Za-z0-9+.-]*)://([A-Za-z0-9.-]+)"
+    r"((?:/[\x21\x22\x24-\x3a\x3c-\x3e\x40-\x7e]*)?(?:\?[\x21\x22\x24-\x7e]+)?)(?:#.*)?"
+)
+
+# Rows a batch found already canonical (returned as is) or that needed full urlparse (fallback);
+# cache_hits/cache_misses only hold what --parse-workers processes reported (see merge_normalize_counts)
+_NORMALIZE_COUNTS = {"canonical": 0, "fallback": 0, "cache_hits": 0, "cache_misses": 0}
+
+@functools.lru_cache(maxsize=256)
+def _normalized_origin(scheme: str, netloc: str) -> str:
+    if netloc.endswith("leeladiamond.com"):
+        return CANONICAL_ORIGIN
+    return f"{scheme.lower()}://{netloc}"
 
 def normalize_url(u: str) -> str:
     """
@@ -12,89 +35,2582 @@ def normalize_url(u: str) -> str:
     u = (u or "").strip()
     if not u:
         return u
+    m = _SIMPLE_URL_RE.fullmatch(u)
+    if m:
+        return _normalized_origin(m[1], m[2]) + m[3]
+    _NORMALIZE_COUNTS["fallback"] += 1
+    return _normalize_parsed(u)
+
+def _normalize_parsed(u: str) -> str:
+    # Reference urlparse normalization; normalize_url's fast path must agree with it
     p = urlparse(u)
     if p.netloc.endswith("leeladiamond.com"):
         p = p._replace(scheme="https", netloc="www.leeladiamond.com")
     # KEEP p.query; only drop fragment
     return urlunparse(p._replace(fragment=""))
 
-def iter_links(csv_source, link_col="link", chunksize=200000):
+def normalize_counts():
+    # This process's normalize counters, origin cache included
+    info = _normalized_origin.cache_info()
+    return {"canonical": _NORMALIZE_COUNTS["canonical"], "fallback": _NORMALIZE_COUNTS["fallback"],
+            "cache_hits": info.hits + _NORMALIZE_COUNTS["cache_hits"],
+            "cache_misses": info.misses + _NORMALIZE_COUNTS["cache_misses"]}
+
+def merge_normalize_counts(counts):
+    # Add what a worker process counted (the difference of two normalize_counts() snapshots)
+    for key, n in counts.items():
+        _NORMALIZE_COUNTS[key] += n
+
+def normalize_stats():
+    # Fast-path coverage: canonical rows and origin cache hits/misses skip urlparse, fallbacks do not
+    counts = normalize_counts()
+    fast = counts["cache_hits"] + counts["cache_misses"] + counts["canonical"]
+    total = fast + counts["fallback"]
+    return {"cache_hits": counts["cache_hits"], "cache_misses": counts["cache_misses"],
+            "cache_size": _normalized_origin.cache_info().currsize,
+            "canonical": counts["canonical"], "fallback": counts["fallback"],
+            "fast_path_ratio": fast / total if total else None}
+
+# URLs normalize_url returns unchanged: the canonical origin, then the same path/query shape as
+# _SIMPLE_URL_RE and no fragment. Valid for Python re (used with fullmatch) and Arrow's RE2.
+_CANONICAL_URL_PATTERN = (
+    r"^https://www\.leeladiamond\.com"
+    r"(?:/[\x21\x22\x24-\x3a\x3c-\x3e\x40-\x7e]*)?(?:\?[\x21\x22\x24-\x7e]+)?$"
+)
+_CANONICAL_URL_RE = re.compile(_CANONICAL_URL_PATTERN)
+
+def normalize_urls(urls):
+    """
+    Batch normalize_url for a list, pandas Series or Arrow string array; returns the same kind.
+    One regex match per URL picks out those already canonical (nearly all of a feed), which are
+    kept as is; only the rest go through normalize_url. Nulls normalize to "" exactly like
+    normalize_url(None).
+    """
+    if isinstance(urls, (list, tuple)):
+        canonical = _CANONICAL_URL_RE.fullmatch
+        out = list(urls)
+        rest = [i for i, u in enumerate(out) if not (u and canonical(u))]
+        for i in rest:
+            out[i] = normalize_url(out[i])
+        _NORMALIZE_COUNTS["canonical"] += len(out) - len(rest)
+        return out
+    if hasattr(urls, "str"):  # pandas Series
+        urls = urls.fillna("").astype(str)
+        rest = ~urls.str.fullmatch(_CANONICAL_URL_PATTERN)
+        _NORMALIZE_COUNTS["canonical"] += len(urls) - int(rest.sum())
+        out = urls.copy()
+        out[rest] = urls[rest].map(normalize_url)
+        return out
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if isinstance(urls, pa.ChunkedArray):
+        urls = urls.combine_chunks()
+    if urls.null_count:
+        urls = pc.fill_null(urls, "")  # copies the whole array, so only when there are nulls
+    rest = pc.invert(pc.match_substring_regex(urls, _CANONICAL_URL_PATTERN))
+    fallback = [normalize_url(u) for u in urls.filter(rest).to_pylist()]
+    _NORMALIZE_COUNTS["canonical"] += len(urls) - len(fallback)
+    if fallback:
+        return pc.replace_with_mask(urls, rest, pa.array(fallback, type=urls.type))
+    return urls
+
+READERS = ("csv", "pandas", "pyarrow")
+
+# pandas' default NA strings, which the original pd.read_csv(...).dropna() reader skipped. Every
+# reader drops link values that normalize to one of these (or to ""), so all backends agree.
+NULL_LINKS = frozenset(("", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND",
+                        "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"))
+
+def is_remote(csv_source):
+    return urlparse(csv_source).scheme in ("http", "https")
+
+class PrefetchReader(io.RawIOBase):
+    """
+    Reads the underlying stream on a background thread into a bounded queue of byte blocks, so
+    network stalls overlap with parsing. `stats` receives the stage timings: busy (reading),
+    idle (queue full, i.e. the parser is behind) and consumer_wait (parser starved for bytes).
+    """
+    def __init__(self, raw, block_size=1 << 20, depth=8, stats=None):
+        super().__init__()
+        self.raw, self.block_size = raw, block_size
+        self.queue = queue.Queue(depth)
+        self.stats = stats if stats is not None else {}
+        self.stats.update(busy=0.0, idle=0.0, consumer_wait=0.0, bytes=0)
+        self.pending, self.eof, self.stopping, self.error = b"", False, False, None
+        self.thread = threading.Thread(target=self._fill, name="feed-prefetch", daemon=True)
+        self.thread.start()
+
+    def _fill(self):
+        try:
+            while not self.stopping:
+                start = time.perf_counter()
+                block = self.raw.read(self.block_size)
+                read_done = time.perf_counter()
+                self.queue.put(block)
+                self.stats["busy"] += read_done - start
+                self.stats["idle"] += time.perf_counter() - read_done
+                self.stats["bytes"] += len(block)
+                if not block:
+                    break
+        except BaseException as e:  # surfaced to the parser on its next read
+            self.queue.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.pending:
+            if self.error is not None:  # the producer has stopped: every later read fails the same way
+                raise self.error
+            if self.eof:
+                return 0
+            start = time.perf_counter()
+            block = self.queue.get()
+            self.stats["consumer_wait"] += time.perf_counter() - start
+            if isinstance(block, BaseException):
+                self.error = block
+                raise block
+            if not block:
+                self.eof = True
+                return 0
+            self.pending = memoryview(block)
+        n = min(len(b), len(self.pending))
+        b[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopping = True
+            while self.thread.is_alive():  # unblock a producer waiting on a full queue
+                try:
+                    self.queue.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            self.raw.close()
+        super().close()
+
+class DecompressingReader(io.RawIOBase):
+    """Raw stream over a streaming decompressor that also closes the compressed source."""
+    def __init__(self, stream, source):
+        super().__init__()
+        self.stream, self.source = stream, source
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self.stream.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.stream.close()
+            finally:
+                self.source.close()
+        super().close()
+
+FEED_COMPRESSIONS = {".gz": "gzip", ".bz2": "bz2", ".zst": "zstd"}
+
+def feed_compression(name, raw):
+    # gzip/bz2/zstd from the file extension, else sniffed from the stream's magic bytes
+    for ext, kind in FEED_COMPRESSIONS.items():
+        if name.lower().endswith(ext):
+            return kind
+    head = raw.peek(10)[:10] if hasattr(raw, "peek") else b""
+    if head.startswith(b"\x1f\x8b"):
+        return "gzip"
+    if head[:3] == b"BZh" and head[4:10] == b"1AY&SY":
+        return "bz2"
+    if head.startswith(b"\x28\xb5\x2f\xfd"):
+        return "zstd"
+    return None
+
+def decompress_feed(raw, kind):
+    # Incremental decompression straight from the source; nothing is written to disk
+    if kind == "gzip":
+        stream = gzip.GzipFile(fileobj=raw, mode="rb")
+    elif kind == "bz2":
+        import bz2
+        stream = bz2.BZ2File(raw, mode="rb")
+    else:
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("Reading a .zst feed requires the zstandard package (pip install zstandard)")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    return io.BufferedReader(DecompressingReader(stream, raw), 1 << 20)
+
+def open_feed(csv_source, prefetch=0, stats=None):
+    # Binary stream for a local path, an http(s) URL or an already-open binary file, decompressed
+    # on the fly for gzip/bz2/zstd feeds; prefetch > 0 reads (and decompresses) that many
+    # 1 MiB blocks ahead on a background thread
+    if hasattr(csv_source, "read"):
+        raw, name = csv_source, getattr(csv_source, "name", "")
+    elif is_remote(csv_source):
+        from urllib.request import urlopen
+        raw, name = urlopen(csv_source), urlparse(csv_source).path
+    else:
+        raw, name = open(csv_source, "rb"), csv_source
+    kind = feed_compression(name if isinstance(name, str) else "", raw)
+    if kind:
+        try:
+            raw = decompress_feed(raw, kind)
+        except BaseException:
+            raw.close()
+            raise
+    if prefetch > 0:
+        return io.BufferedReader(PrefetchReader(raw, depth=prefetch, stats=stats), 1 << 20)
+    return raw
+
+FEED_META_NAME = "feed-meta.json"
+
+def load_feed_meta(cache_dir):
+    path = os.path.join(cache_dir, FEED_META_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_feed_meta(cache_dir, meta):
+    tmp = os.path.join(cache_dir, FEED_META_NAME + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp, os.path.join(cache_dir, FEED_META_NAME))
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+class CachingReader(io.RawIOBase):
+    """
+    Raw stream over an HTTP response that hashes every byte read and saves it to `path`, so the
+    parser consumes the download as it arrives. At EOF the copy replaces `path` and
+    on_complete(sha256) runs; a stream closed early leaves only the ".part" file.
+    """
+    def __init__(self, resp, path, on_complete):
+        super().__init__()
+        self.resp, self.name, self.on_complete = resp, path, on_complete
+        self.file = open(path + ".part", "wb")
+        self.hash, self.sha256 = hashlib.sha256(), None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.resp.readinto(b)
+        if n:
+            data = memoryview(b)[:n]
+            self.hash.update(data)
+            self.file.write(data)
+        elif self.sha256 is None:
+            self.file.close()
+            os.replace(self.name + ".part", self.name)
+            self.sha256 = self.hash.hexdigest()
+            self.on_complete(self.sha256)
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+            self.resp.close()
+        super().close()
+
+def fetch_feed(url, cache_dir, timeout=60, stream=False):
+    """
+    Download url into cache_dir with a conditional GET (If-None-Match / If-Modified-Since).
+    Returns (local path, sha256 of the content, whether it was downloaded); a 304 reuses the copy.
+    With stream=True a 200 returns (binary stream, None, True) instead: reading it saves and
+    hashes the feed on the way, and its .raw.sha256 is set once it has been read to the end.
+    """
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, os.path.basename(urlparse(url).path) or "feed.csv")
+    meta = load_feed_meta(cache_dir)
+    cached = meta.get("url") == url and os.path.exists(path)
+    headers = {}
+    if cached and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if cached and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+    try:
+        resp = urlopen(Request(url, headers=headers), timeout=timeout)
+    except HTTPError as e:
+        if e.code == 304 and cached:
+            return path, meta["sha256"], False
+        raise
+
+    def complete(sha256):
+        meta.update(url=url, etag=resp.headers.get("ETag"), last_modified=resp.headers.get("Last-Modified"),
+                    sha256=sha256)
+        save_feed_meta(cache_dir, meta)
+
+    reader = io.BufferedReader(CachingReader(resp, path, complete), 1 << 20)
+    if stream:
+        return reader, None, True
+    with reader:
+        while reader.read(1 << 20):
+            pass
+    return path, meta["sha256"], True
+
+# --profile stage markers: thread id -> stage label, set per batch/part (never per row)
+_PROFILE_STAGES = {}
+_PROFILER = None
+
+def profile_stage(name):
+    # Label the calling thread's work as `name` until the next marker; returns the label to restore
+    ident = threading.get_ident()
+    previous = _PROFILE_STAGES.get(ident)
+    _PROFILE_STAGES[ident] = name
+    if _PROFILER is not None:
+        _PROFILER.switch(name)
+    return previous
+
+class RunStats:
+    """
+    Wall/CPU seconds per stage plus run counters, for --stats-json. Stages are timed around whole
+    batches, never per row; CPU is process time, so it includes helper threads (prefetch, Arrow's
+    pool, writer threads) that ran during the stage. The pyarrow reader drops repeated raw values
+    inside a batch before normalization, so those (including repeated blanks) count as duplicates.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = dict.fromkeys(("rows_read", "null_links", "duplicates", "rewritten"), 0)
+
+    @staticmethod
+    def clock():
+        return time.perf_counter(), time.process_time()
+
+    def add(self, stage, wall, cpu=None):
+        totals = self.stages.setdefault(stage, {"wall_seconds": 0.0, "cpu_seconds": 0.0})
+        totals["wall_seconds"] += wall
+        if cpu is None:
+            totals["cpu_seconds"] = None
+        elif totals["cpu_seconds"] is not None:
+            totals["cpu_seconds"] += cpu
+
+    def since(self, stage, start):
+        wall, cpu = self.clock()
+        self.add(stage, wall - start[0], cpu - start[1])
+
+def peak_rss_mib():
+    # (this process, largest child) peak resident set size in MiB; ru_maxrss is KiB on Linux
+    import resource
+    return tuple(round(resource.getrusage(who).ru_maxrss / 1024, 1)
+                 for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+
+def save_run_report(path, stats, run_start, **extra):
+    # --stats-json: stage times, counters and peak RSS plus whatever the caller adds (parts, ...)
+    wall, cpu = RunStats.clock()
+    rss_self, rss_children = peak_rss_mib()
+    rounded = {stage: {k: None if v is None else round(v, 4) for k, v in t.items()}
+               for stage, t in stats.stages.items()}
+    report = {"generated_at": utc_timestamp(),
+              "total": {"wall_seconds": round(wall - run_start[0], 4), "cpu_seconds": round(cpu - run_start[1], 4)},
+              "stages": rounded, "counters": stats.counters,
+              "peak_rss_mib": {"self": rss_self, "children": rss_children}, **extra}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+def iter_raw_links_csv(csv_source, link_col="link", chunksize=200000, extra_cols=(), stats=None):
+    # Stream the feed with the stdlib csv module, keeping only the link (and requested) columns
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with open_feed(csv_source) as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text)
+        header = next(reader, None) or []
+        for col in (link_col, *extra_cols):
+            if col not in header:
+                raise ValueError(f"Column {col!r} not found in CSV header")
+        idx = header.index(link_col)
+        if extra_cols:
+            idxs = [header.index(c) for c in extra_cols]
+            need = max(idx, *idxs)
+            columns = [[] for _ in range(len(idxs) + 1)]
+            for row in reader:
+                if len(row) > need:
+                    columns[0].append(row[idx])
+                    for col, i in zip(columns[1:], idxs):
+                        col.append(row[i])
+                    if len(columns[0]) >= chunksize:
+                        _count_rows(stats, len(columns[0]))
+                        yield columns
+                        columns = [[] for _ in range(len(idxs) + 1)]
+                else:
+                    _count_rows(stats, 1, 1)
+            if columns[0]:
+                _count_rows(stats, len(columns[0]))
+                yield columns
+            return
+        batch = []
+        for row in reader:
+            if len(row) > idx:
+                batch.append(row[idx])
+                if len(batch) >= chunksize:
+                    _count_rows(stats, len(batch))
+                    yield [batch]
+                    batch = []
+            else:
+                _count_rows(stats, 1, 1)
+        if batch:
+            _count_rows(stats, len(batch))
+            yield [batch]
+
+def _count_rows(stats, rows, null_links=0):
+    # Rows the reader parsed, and how many of them had no link value (short or null rows)
+    if stats is not None:
+        stats.counters["rows_read"] += rows
+        stats.counters["null_links"] += null_links
+
+def iter_raw_links_pandas(csv_source, link_col="link", chunksize=200000, extra_cols=(), stats=None):
+    import pandas as pd  # only loaded when this backend is selected
+    cols = [link_col, *extra_cols]
+    with open_feed(csv_source) as raw:
+        for chunk in pd.read_csv(raw, dtype=str, usecols=cols, chunksize=chunksize):
+            rows = len(chunk)
+            chunk = chunk.dropna(subset=[link_col])
+            _count_rows(stats, rows, rows - len(chunk))
+            yield [chunk[link_col].astype(str)] + [chunk[c].fillna("").tolist() for c in extra_cols]
+
+def iter_raw_links_pyarrow(csv_source, link_col="link", extra_cols=(), block_size=16 << 20, stats=None):
+    # Columnar streaming parse of the link (and requested) columns; blocks are parsed on Arrow's thread pool
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pacsv
+    cols = [link_col, *extra_cols]
+    short = []
+
+    def skip_short(row):
+        # Short rows have no link value: skip them like the csv reader (too-long rows still fail)
+        if row.actual_columns < row.expected_columns:
+            short.append(row.number)
+            return "skip"
+        return "error"
+
+    with open_feed(csv_source) as raw:
+        batches = pacsv.open_csv(
+            raw,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=block_size),
+            parse_options=pacsv.ParseOptions(newlines_in_values=True, invalid_row_handler=skip_short),
+            convert_options=pacsv.ConvertOptions(include_columns=cols,
+                                                 column_types={c: pa.string() for c in cols}),
+        )
+        for batch in batches:
+            _count_rows(stats, batch.num_rows + len(short), batch.column(0).null_count + len(short))
+            short.clear()
+            if not extra_cols:
+                # unique keeps first-seen order, so in-batch duplicates never reach Python
+                links = pc.unique(batch.column(0).drop_null())
+                if stats is not None:
+                    stats.counters["duplicates"] += batch.num_rows - batch.column(0).null_count - len(links)
+                yield [links]
+                continue
+            batch = batch.filter(pc.is_valid(batch.column(0)))
+            yield [batch.column(0)] + [pc.fill_null(batch.column(i), "").to_pylist()
+                                       for i in range(1, len(cols))]
+
+def iter_feed_columns(csv_source, link_col="link", chunksize=200000, reader="csv", extra_cols=(), stats=None):
+    # Raw (un-normalized) column values per parsed chunk: the link column in the backend's native
+    # container (list, pandas Series or Arrow array), then each extra column as a list
+    if reader == "pandas":
+        return iter_raw_links_pandas(csv_source, link_col, chunksize, extra_cols, stats)
+    if reader == "pyarrow":
+        return iter_raw_links_pyarrow(csv_source, link_col, extra_cols, stats=stats)
+    if reader == "csv":
+        return iter_raw_links_csv(csv_source, link_col, chunksize, extra_cols, stats)
+    raise ValueError(f"Unknown reader {reader!r}; expected one of {', '.join(READERS)}")
+
+def iter_link_batches(csv_source, link_col="link", chunksize=200000, reader="csv"):
+    # Raw (un-normalized) link values per parsed chunk, in the backend's native
+    # container: list (csv), pandas Series (pandas) or Arrow array (pyarrow)
+    for columns in iter_feed_columns(csv_source, link_col, chunksize, reader):
+        yield columns[0]
+
+def iter_feed_batches(csv_source, link_col="link", chunksize=200000, reader="csv", extra_cols=(), stats=None,
+                      parse_workers=0):
+    # (urls, extras) per parsed chunk: normalized URLs, minus empty and NULL_LINKS values, and for
+    # each extra column the values from the same rows. With a RunStats, parse and normalize time and the
+    # row/null/duplicate/rewritten counters are recorded per chunk. parse_workers > 1 splits
+    # local, uncompressed feeds read with the csv reader across processes (iter_feed_ranges).
+    if parse_workers > 1 and reader == "csv" and is_splittable(csv_source):
+        yield from iter_feed_ranges(csv_source, link_col, extra_cols, parse_workers, stats)
+        return
+    columns = iter_feed_columns(csv_source, link_col, chunksize, reader, extra_cols, stats)
+    timer = stats or RunStats()
+    while True:
+        start = timer.clock()
+        stage = profile_stage("iter_links")
+        chunk = next(columns, None)
+        if chunk is None:
+            profile_stage(stage)
+            return
+        timer.since("parse", start)
+        start = timer.clock()
+        batch, *extras = chunk
+        urls = normalize_urls(batch)
+        if stats is not None:
+            stats.counters["rewritten"] += _count_rewritten(batch, urls)
+        # Series and Arrow arrays both convert back to Python strings via tolist()
+        urls = urls if isinstance(urls, list) else urls.tolist()
+        candidates = len(urls)
+        if not extra_cols:
+            urls = [url for url in urls if url not in NULL_LINKS]
+            extras = []
+        else:
+            keep = [i for i, url in enumerate(urls) if url not in NULL_LINKS]
+            urls, extras = [urls[i] for i in keep], [[col[i] for i in keep] for col in extras]
+        if stats is not None:
+            stats.counters["null_links"] += candidates - len(urls)
+        timer.since("normalize", start)
+        profile_stage(stage)
+        yield urls, extras
+
+def is_splittable(csv_source):
+    # Byte ranges need a local, uncompressed file
+    if not isinstance(csv_source, str) or is_remote(csv_source) or not os.path.isfile(csv_source):
+        return False
+    with open(csv_source, "rb") as raw:
+        return feed_compression(csv_source, raw) is None
+
+def _count_quotes(mm, start, end, step=64 << 20):
+    return sum(mm[i:min(i + step, end)].count(b'"') for i in range(start, end, step))
+
+def _record_end(mm, pos, quotes=0):
+    # Offset just past the first newline at or after pos that lies outside quotes, given the
+    # `quotes` quote characters since the record began ("" escapes keep the parity); len(mm) at EOF
+    while True:
+        nl = mm.find(b"\n", pos)
+        if nl < 0:
+            return len(mm)
+        quotes += _count_quotes(mm, pos, nl)
+        if quotes % 2 == 0:
+            return nl + 1
+        pos = nl + 1
+
+def record_ranges(mm, start, parts, range_bytes=32 << 20):
+    # Split mm[start:] into at least `parts` ranges of about range_bytes, each starting on a record
+    size = len(mm)
+    count = max(parts, -(-(size - start) // range_bytes))
+    step = max((size - start) // count, 1)
+    bounds = [start]
+    for k in range(1, count):
+        target = start + k * step
+        if target <= bounds[-1]:
+            continue
+        end = _record_end(mm, target, _count_quotes(mm, bounds[-1], target))
+        if end >= size:
+            break
+        bounds.append(end)
+    return list(zip(bounds, bounds[1:] + [size]))
+
+def _parse_range(path, start, end, link_idx, extra_idxs):
+    # Worker: parse and normalize one record-aligned byte range. Returns (urls, extras, rows read,
+    # null links, rewritten, wall seconds, CPU seconds, normalize wall seconds, normalize CPU seconds,
+    # normalize counts), matching iter_feed_batches' csv path.
+    started, cpu = time.perf_counter(), time.process_time()
+    csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode("utf-8")
+    need = max([link_idx, *extra_idxs])
+    links, extras, short = [], [[] for _ in extra_idxs], 0
+    for row in csv.reader(io.StringIO(text, newline="")):
+        if len(row) > need:
+            links.append(row[link_idx])
+            for col, i in zip(extras, extra_idxs):
+                col.append(row[i])
+        else:
+            short += 1
+    del text
+    counts, normalize_start = normalize_counts(), (time.perf_counter(), time.process_time())
+    urls = normalize_urls(links)
+    rewritten = sum(map(str.__ne__, links, urls))
+    keep = [i for i, url in enumerate(urls) if url not in NULL_LINKS]
+    if len(keep) < len(urls):
+        urls, extras = [urls[i] for i in keep], [[col[i] for i in keep] for col in extras]
+    counts = {k: n - counts[k] for k, n in normalize_counts().items()}
+    return (urls, extras, len(links) + short, short + len(links) - len(urls), rewritten,
+            time.perf_counter() - started, time.process_time() - cpu,
+            time.perf_counter() - normalize_start[0], time.process_time() - normalize_start[1], counts)
+
+def iter_feed_ranges(path, link_col="link", extra_cols=(), workers=2, stats=None, range_bytes=32 << 20):
+    """
+    iter_feed_batches for a local, uncompressed csv feed parsed on a process pool: the file is
+    memory-mapped and split into record-aligned byte ranges (newlines inside quoted fields are
+    skipped by quote parity), each range is parsed and normalized in a worker, and batches come
+    back in file order, so the URL sequence -- and the parts -- match the sequential reader.
+    Records must end in \\n or \\r\\n.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header_end = _record_end(mm, 0)
+            header = next(csv.reader(io.StringIO(mm[:header_end].decode("utf-8-sig"), newline="")), [])
+            for col in (link_col, *extra_cols):
+                if col not in header:
+                    raise ValueError(f"Column {col!r} not found in CSV header")
+            ranges = record_ranges(mm, header_end, workers, range_bytes) if header_end < len(mm) else []
+    from concurrent.futures import ProcessPoolExecutor
+    link_idx, extra_idxs = header.index(link_col), [header.index(c) for c in extra_cols]
+    timer = stats or RunStats()
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        ranges = iter(ranges)
+        while True:
+            # keep every worker busy plus one range queued each, in file order
+            for start, end in ranges:
+                pending.append(pool.submit(_parse_range, path, start, end, link_idx, extra_idxs))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            start = timer.clock()
+            stage = profile_stage("iter_links")
+            (urls, extras, rows, nulls, rewritten, wall, cpu, normalize_wall, normalize_cpu,
+             counts) = pending.popleft().result()
+            profile_stage(stage)
+            timer.since("parse", start)
+            # worker time, summed across workers; normalize is part of parse_workers
+            timer.add("parse_workers", wall, cpu)
+            timer.add("normalize", normalize_wall, normalize_cpu)
+            merge_normalize_counts(counts)
+            if stats is not None:
+                for key, n in (("rows_read", rows), ("null_links", nulls), ("rewritten", rewritten)):
+                    stats.counters[key] += n
+            yield urls, extras
+
+def _count_rewritten(raw, urls):
+    # Values normalize_urls changed (whitespace, scheme/host variants), compared in the batch's container
+    if isinstance(raw, list):
+        return sum(map(str.__ne__, raw, urls))
+    if hasattr(raw, "to_pylist"):
+        import pyarrow.compute as pc
+        return pc.sum(pc.not_equal(raw, urls)).as_py() or 0
+    return int((raw != urls).sum())
+
+def iter_url_batches(csv_source, link_col="link", chunksize=200000, reader="csv"):
+    # Lists of normalized, non-empty URLs, one per parsed chunk
+    for urls, _ in iter_feed_batches(csv_source, link_col, chunksize, reader):
+        yield urls
+
+def iter_links(csv_source, link_col="link", chunksize=200000, reader="csv"):
     # Stream read extremely large CSVs
-    for chunk in pd.read_csv(csv_source, dtype=str, usecols=[link_col], chunksize=chunksize):
+    for urls in iter_url_batches(csv_source, link_col, chunksize, reader):
         # preserve as-is (after normalization)
-        for url in chunk[link_col].dropna().astype(str):
-            url = normalize_url(url)
-            if url:
-                yield url
+        yield from urls
+
+DEDUP_MODES = ("set", "hash64", "hash128", "disk", "bloom")
 
-def write_urlset_xml(file_path, urls):
-    # Write sitemap with lastmod, priority, and changefreq for better crawl guidance
+def url_hashes(urls, words=2):
+    # (len(urls), words) uint64 keys from Python's own (SipHash) string hash, computed in C with no
+    # per-URL digest objects; the second word hashes the URL behind a "\x00" prefix. Keys are only
+    # stable within one process (hash randomization), which is all the dedup state needs.
+    import numpy as np
+    keys = np.empty((len(urls), words), dtype=np.int64)
+    keys[:, 0] = np.fromiter(map(hash, urls), dtype=np.int64, count=len(urls))
+    if words > 1:
+        keys[:, 1] = np.fromiter(map(hash, map("\x00".__add__, urls)), dtype=np.int64, count=len(urls))
+    return keys.view(np.uint64)
+
+def _first_occurrences(keys):
+    # Row indices of the first occurrence of each distinct key, in input order (rows compared as
+    # one opaque value: much faster than np.unique(axis=0))
+    import numpy as np
+    rows = np.ascontiguousarray(keys).view(f"V{keys.shape[1] * keys.itemsize}").ravel()
+    _, first = np.unique(rows, return_index=True)
+    first.sort()
+    return first
+
+class SetDedup:
+    """Exact dedup on the URL strings themselves (the original in-memory set)."""
+    name = "set"
+
+    def __init__(self):
+        self.seen = set()
+        self._str_bytes = 0
+
+    def new_indices(self, urls):
+        # Positions of URLs not seen before (first occurrence within the batch), in order
+        new = []
+        for i, url in enumerate(urls):
+            if url not in self.seen:
+                self.seen.add(url)
+                self._str_bytes += sys.getsizeof(url)
+                new.append(i)
+        return new
+
+    def __len__(self):
+        return len(self.seen)
+
+    def memory_bytes(self):
+        return sys.getsizeof(self.seen) + self._str_bytes
+
+    def disk_bytes(self):
+        return 0
+
+    def close(self):
+        self.seen = set()
+
+class HashTableDedup:
+    """
+    Exact-by-hash dedup: 64- or 128-bit URL hashes in a NumPy open-addressing table
+    (linear probing, grown at 70% load), so memory is ~16/32 bytes per URL instead of the string.
+    Batches are probed and inserted vectorized, one probe step per round. `capacity` (expected
+    unique URLs) presizes the table so it never has to grow.
+    """
+    def __init__(self, bits=128, capacity=None):
+        import numpy as np
+        self.np = np
+        self.words = bits // 64
+        self.name = f"hash{bits}"
+        self.count = 0
+        slots = (capacity or 1 << 15) * 10 // 7 + 1
+        self.table = np.zeros((max(1 << (slots - 1).bit_length(), 16), self.words), dtype=np.uint64)
+
+    def __len__(self):
+        return self.count
+
+    def new_indices(self, urls):
+        if not urls:
+            return []
+        return self.insert(url_hashes(urls, self.words)).tolist()
+
+    def insert(self, keys):
+        # Insert hash rows; return input indices of keys not seen before (first occurrence, in order)
+        keys[keys[:, 0] == 0, 0] = 1  # 0 marks an empty slot
+        while (self.count + len(keys)) * 10 > len(self.table) * 7:
+            self._grow()
+        new = self.np.flatnonzero(self._probe_insert(keys))
+        self.count += len(new)
+        return new
+
+    def _probe_insert(self, keys):
+        # Equal keys probe the same slots in lockstep, so the first of them claims the empty slot and
+        # the rest find it next round: duplicates within a batch need no separate pass
+        np = self.np
+        mask = np.uint64(len(self.table) - 1)
+        slots = keys[:, 0] & mask
+        inserted = np.zeros(len(keys), dtype=bool)
+        pending = np.arange(len(keys))
+        while pending.size:
+            cur = self.table[slots[pending]]
+            empty = cur[:, 0] == 0
+            found = cur[:, 0] == keys[pending, 0]
+            if self.words > 1:
+                hit = pending[found]
+                found[found] = (cur[found, 1:] == keys[hit, 1:]).all(axis=1)
+            # Several keys may race for one empty slot: the lowest row takes it, the rest retry it next
+            # round. One sort of (slot, row) pairs packed into a uint64 finds each slot's lowest row.
+            claim = np.sort((slots[pending[empty]] << np.uint64(32)) | pending[empty].astype(np.uint64))
+            first = np.ones(len(claim), dtype=bool)
+            first[1:] = (claim[1:] >> np.uint64(32)) != (claim[:-1] >> np.uint64(32))
+            rows = (claim & np.uint64(0xFFFFFFFF)).astype(np.intp)
+            won = rows[first]
+            self.table[slots[won]] = keys[won]
+            inserted[won] = True
+            moved = pending[~empty & ~found]
+            slots[moved] = (slots[moved] + np.uint64(1)) & mask
+            pending = np.concatenate([rows[~first], moved])
+        return inserted
+
+    def _grow(self):
+        # Rehash slice by slice, so the peak is the old table plus the new one and no more
+        old = self.table
+        self.table = self.np.zeros((len(old) * 2, self.words), dtype=self.np.uint64)
+        for i in range(0, len(old), 1 << 16):
+            chunk = old[i:i + (1 << 16)]
+            self._probe_insert(chunk[chunk[:, 0] != 0])
+
+    def keys(self):
+        return self.table[self.table[:, 0] != 0]
+
+    def clear(self):
+        self.table[:] = 0
+        self.count = 0
+
+    def memory_bytes(self):
+        return self.table.nbytes
+
+    def disk_bytes(self):
+        return 0
+
+    def close(self):
+        pass
+
+class DiskDedup:
+    """
+    Exact-by-hash dedup with bounded memory: 128-bit hashes live in an in-memory table until it
+    holds max_entries, then are spilled as a sorted run file that later batches binary-search
+    through a read-only memmap.
+    """
+    name = "disk"
+
+    def __init__(self, max_entries=1 << 20, spill_dir=None):
+        import numpy as np
+        self.np = np
+        self.max_entries = max_entries
+        self.dtype = np.dtype([("hi", "<u8"), ("lo", "<u8")])
+        self.table = HashTableDedup(128, max_entries)
+        import tempfile
+        self.dir = tempfile.mkdtemp(prefix="sitemap-dedup-", dir=spill_dir)
+        self.runs = []
+        self.spilled = 0
+
+    def __len__(self):
+        return self.spilled + len(self.table)
+
+    def new_indices(self, urls):
+        np = self.np
+        if not urls:
+            return []
+        keys = url_hashes(urls, 2)
+        keys[keys[:, 0] == 0, 0] = 1  # match HashTableDedup's empty-slot remap before comparing runs
+        idx = np.arange(len(keys))
+        if self.runs:
+            probe = np.ascontiguousarray(keys).view(self.dtype).ravel()
+            unseen = np.ones(len(keys), dtype=bool)
+            for run in self.runs:
+                pos = np.minimum(np.searchsorted(run, probe), len(run) - 1)
+                unseen &= run[pos] != probe
+            keys, idx = keys[unseen], idx[unseen]
+        new = idx[self.table.insert(keys)]
+        if len(self.table) >= self.max_entries:
+            self._spill()
+        return new.tolist()
+
+    def _spill(self):
+        np = self.np
+        run = np.ascontiguousarray(self.table.keys()).view(self.dtype).ravel()
+        run.sort()
+        path = os.path.join(self.dir, f"run-{len(self.runs):05d}.bin")
+        run.tofile(path)
+        self.runs.append(np.memmap(path, dtype=self.dtype, mode="r"))
+        self.spilled += len(run)
+        self.table.clear()
+
+    def memory_bytes(self):
+        return self.table.memory_bytes()
+
+    def disk_bytes(self):
+        return sum(run.nbytes for run in self.runs)
+
+    def close(self):
+        self.runs = []
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+class BloomDedup:
+    """
+    Probabilistic dedup: a Bloom filter sized for `capacity` URLs at `error_rate` false positives.
+    A false positive drops a URL that was never seen, so use only where that is acceptable.
+    """
+    name = "bloom"
+
+    def __init__(self, capacity=20_000_000, error_rate=1e-6):
+        import math
+        import numpy as np
+        self.np = np
+        self.nbits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = np.zeros((self.nbits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def new_indices(self, urls):
+        np = self.np
+        if not urls:
+            return []
+        keys = url_hashes(urls, 2)
+        cand = _first_occurrences(keys)
+        h1, h2 = keys[cand, 0], keys[cand, 1] | np.uint64(1)
+        # Double hashing: bit i of each key is (h1 + i*h2) mod nbits
+        steps = np.arange(self.k, dtype=np.uint64)
+        pos = (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.nbits)
+        byte, bit = pos >> np.uint64(3), (pos & np.uint64(7)).astype(np.uint8)
+        present = ((self.bits[byte] >> bit) & 1).all(axis=1)
+        fresh = ~present
+        np.bitwise_or.at(self.bits, byte[fresh].ravel(), (1 << bit[fresh]).ravel().astype(np.uint8))
+        self.count += int(fresh.sum())
+        return cand[fresh].tolist()
+
+    def memory_bytes(self):
+        return self.bits.nbytes
+
+    def disk_bytes(self):
+        return 0
+
+    def close(self):
+        pass
+
+def make_dedup(mode="set", capacity=None, error_rate=1e-6, spill_dir=None):
+    if mode == "set":
+        return SetDedup()
+    if mode in ("hash64", "hash128"):
+        return HashTableDedup(int(mode[4:]), capacity)
+    if mode == "disk":
+        return DiskDedup(capacity or 1 << 20, spill_dir)
+    if mode == "bloom":
+        return BloomDedup(capacity or 20_000_000, error_rate)
+    raise ValueError(f"Unknown dedup mode {mode!r}; expected one of {', '.join(DEDUP_MODES)}")
+
+WRITE_CHUNK = 8192  # URLs rendered per join/write
+COMPRESSIONS = ("none", "gzip")
+
+def part_filename(basename, part, compress="none"):
+    return f"{basename}{part:05d}.xml" + (".gz" if compress == "gzip" else "")
+
+class HashingFile:
+    """
+    Write-through file that hashes the bytes landing on disk. On close, `digests` (if given) gets
+    the base64 MD5 and, when google-crc32c is installed, CRC32C in the form object stores report.
+    """
+    def __init__(self, f, digests=None):
+        self.f, self.digests = f, digests
+        self.md5 = hashlib.md5() if digests is not None else None
+        self.crc32c = self.crc = None
+        if digests is not None:
+            try:
+                import google_crc32c
+                self.crc32c, self.crc = google_crc32c, 0
+            except ImportError:
+                pass
+
+    def write(self, data):
+        if self.md5 is not None:
+            self.md5.update(data)
+            if self.crc32c is not None:
+                self.crc = self.crc32c.extend(self.crc, data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+        if self.digests is not None:
+            self.digests["md5"] = base64.b64encode(self.md5.digest()).decode("ascii")
+            if self.crc is not None:
+                self.digests["crc32c"] = base64.b64encode(self.crc.to_bytes(4, "big")).decode("ascii")
+
+class SitemapSink:
+    """
+    Binary sink for one sitemap file; write() returns the uncompressed length. gzip uses mtime=0
+    so identical content gives identical bytes. With `fileobj`, bytes go there instead of a new
+    file at file_path (whose basename still names the gzip member).
+    """
+    def __init__(self, file_path, compress="none", level=6, digests=None, fileobj=None):
+        self.file = HashingFile(fileobj if fileobj is not None else open(file_path, "wb", buffering=1 << 20),
+                                digests)
+        self.gz = None
+        if compress == "gzip":
+            self.gz = gzip.GzipFile(file_path, mode="wb", compresslevel=level, fileobj=self.file, mtime=0)
+
+    def write(self, data):
+        return (self.gz or self.file).write(data)
+
+    def close(self):
+        if self.gz is not None:
+            self.gz.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_sitemap(file_path, compress="none", level=6, digests=None, fileobj=None):
+    return SitemapSink(file_path, compress, level, digests, fileobj)
+
+def escape(data):
+    # Same as xml.sax.saxutils.escape, which would pull in urllib.request (~20 ms) at import
+    return data.replace("&", "&amp;").replace(">", "&gt;").replace("<", "&lt;")
+
+def escape_many(strings):
+    # Batch escape(): one scan of the joined batch proves the common case (nothing to escape),
+    # otherwise only the strings holding &, < or > (e.g. query strings) go through escape()
+    joined = "".join(strings)
+    if "&" not in joined and "<" not in joined and ">" not in joined:
+        return strings
+    return [escape(s) if "&" in s or "<" in s or ">" in s else s for s in strings]
+
+URLSET_HEADER = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                 b'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+URLSET_FOOTER = b"</urlset>\n"
+_URL_HEAD = "  <url>\n    <loc>"
+_URL_LASTMOD = "</loc>\n    <lastmod>"
+_URL_REST = ("</lastmod>\n"
+             "    <changefreq>weekly</changefreq>\n"
+             "    <priority>0.8</priority>\n"
+             "  </url>\n")
+URL_ENTRY_OVERHEAD = len(_URL_HEAD) + len(_URL_LASTMOD) + len(_URL_REST)
+MAX_SITEMAP_BYTES = 50 * 1024 * 1024  # sitemap protocol limit, uncompressed
+
+def url_entry_bytes(url, lastmod):
+    # Exact serialized size of one <url> entry as write_urlset_xml renders it
+    size = len(url) if url.isascii() else len(url.encode("utf-8"))
+    if "&" in url or "<" in url or ">" in url:
+        size += 4 * url.count("&") + 3 * (url.count("<") + url.count(">"))
+    return URL_ENTRY_OVERHEAD + size + len(lastmod)
+
+def part_budget(max_bytes):
+    # Bytes left for <url> entries in a part of max_bytes; the part must hold its header, footer
+    # and at least one (shortest possible) entry, and stay within the protocol limit
+    low = len(URLSET_HEADER) + len(URLSET_FOOTER) + url_entry_bytes("/", "YYYY-MM-DD")
+    if not low <= max_bytes <= MAX_SITEMAP_BYTES:
+        raise ValueError(f"max_bytes must be between {low} and {MAX_SITEMAP_BYTES}, got {max_bytes}")
+    return max_bytes - len(URLSET_HEADER) - len(URLSET_FOOTER)
+
+def check_entry_size(url, size, budget):
+    # A <url> entry larger than a whole part's budget can never be written within max_bytes
+    if size > budget:
+        raise ValueError(f"<url> entry of {size} bytes exceeds the {budget} bytes a part has for entries "
+                         f"(raise max_bytes): {url[:200]}")
+
+class PartAccumulator:
+    """
+    The part rollover rule of every build path (build(), plan_incremental, SitemapBuilder): a part
+    takes entries until it holds per_file of them or the next one would push its <url> entries past
+    max_bytes. push() adds an entry and returns the (items, lastmods) of a part it completed, if
+    any; fits()/add() let plan_incremental top up parts that already hold kept URLs.
+    """
+    def __init__(self, per_file, max_bytes=MAX_SITEMAP_BYTES, lastmods=False):
+        self.per_file, self.budget, self.with_lastmods = per_file, part_budget(max_bytes), lastmods
+        self.start()
+
+    def start(self, items=None, size=0):
+        # Begin a part: empty, or one already holding `items` with `size` bytes of entries
+        self.items = [] if items is None else items
+        self.lastmods = [] if self.with_lastmods else None
+        self.size = size
+
+    def fits(self, size):
+        # An empty part takes any entry that passed check_entry_size
+        return len(self.items) < self.per_file and (not self.items or self.size + size <= self.budget)
+
+    def add(self, item, lastmod, size):
+        self.items.append(item)
+        if self.lastmods is not None:
+            self.lastmods.append(lastmod)
+        self.size += size
+
+    def take(self):
+        part = self.items, self.lastmods
+        self.start()
+        return part
+
+    def push(self, url, lastmod, size):
+        # Roll over before an entry that does not fit and right after the part reaches per_file
+        check_entry_size(url, size, self.budget)
+        done = None if self.fits(size) else self.take()
+        self.add(url, lastmod, size)
+        if len(self.items) >= self.per_file:
+            done = self.take()
+        return done
+
+def write_urlset_xml(file_path, urls, compress="none", level=6, lastmods=None, digests=None, fileobj=None):
+    # Write sitemap with lastmod, priority, and changefreq for better crawl guidance.
+    # lastmods: optional per-URL W3C dates; empty entries fall back to today.
+    # digests: optional dict that receives the file's MD5/CRC32C (see HashingFile).
+    # fileobj: optional binary file to write (and close) instead of creating file_path.
+    # Returns the uncompressed size in bytes.
     today = datetime.datetime.now(datetime.UTC).date().isoformat()
-    with open(file_path, "w", encoding="utf-8") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
-        for u in urls:
-            f.write("  <url>\n")
-            f.write(f"    <loc>{escape(u)}</loc>\n")
-            f.write(f"    <lastmod>{today}</lastmod>\n")
-            f.write("    <changefreq>weekly</changefreq>\n")
-            f.write("    <priority>0.8</priority>\n")
-            f.write("  </url>\n")
-        f.write("</urlset>\n")
-
-def write_index_xml(index_path, part_files, public_base_url):
-    now = datetime.datetime.now(datetime.UTC).replace(microsecond=0).isoformat().replace("+00:00", "Z")
-    with open(index_path, "w", encoding="utf-8") as f:
-        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-        f.write('<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
-        for name in part_files:
-            loc = f"{public_base_url.rstrip('/')}/{name}"
-            f.write("  <sitemap>\n")
-            f.write(f"    <loc>{escape(loc)}</loc>\n")
-            f.write(f"    <lastmod>{now}</lastmod>\n")
-            f.write("  </sitemap>\n")
-        f.write("</sitemapindex>\n")
+    # Everything between two <loc> values is constant, so render each chunk with one join
+    tail = _URL_LASTMOD + today + _URL_REST
+    sep = tail + _URL_HEAD
+    with open_sitemap(file_path, compress, level, digests, fileobj) as f:
+        # both sinks return the uncompressed length from write()
+        size = f.write(URLSET_HEADER)
+        for i in range(0, len(urls), WRITE_CHUNK):
+            chunk = urls[i:i + WRITE_CHUNK]
+            if lastmods is None:
+                text = _URL_HEAD + sep.join(escape_many(chunk)) + tail
+            else:
+                dates = escape_many([m or today for m in lastmods[i:i + WRITE_CHUNK]])
+                text = "".join(f"{_URL_HEAD}{u}{_URL_LASTMOD}{m}{_URL_REST}"
+                               for u, m in zip(escape_many(chunk), dates))
+            size += f.write(text.encode("utf-8"))
+        size += f.write(URLSET_FOOTER)
+    return size
+
+def utc_timestamp():
+    return datetime.datetime.now(datetime.UTC).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+def write_index_xml(index_path, part_files, public_base_url, compress="none", level=6, lastmods=None,
+                    digests=None, fileobj=None):
+    # lastmods: optional per-part timestamps (e.g. unchanged parts keep their previous one)
+    now = utc_timestamp()
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>\n',
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+    locs = escape_many([f"{public_base_url.rstrip('/')}/{name}" for name in part_files])
+    for i, loc in enumerate(locs):
+        lines.append("  <sitemap>\n")
+        lines.append(f"    <loc>{loc}</loc>\n")
+        lines.append(f"    <lastmod>{lastmods[i] if lastmods else now}</lastmod>\n")
+        lines.append("  </sitemap>\n")
+    lines.append("</sitemapindex>\n")
+    with open_sitemap(index_path, compress, level, digests, fileobj) as f:
+        return f.write("".join(lines).encode("utf-8"))
+
+def _write_part(file_path, urls, compress, level, lastmods=None):
+    # Pool entry point: (part name, uncompressed bytes, wall and CPU seconds spent writing, file digests);
+    # thread_time is this worker thread's CPU alone, so it is right for thread and process pools alike
+    start, cpu = time.perf_counter(), time.thread_time()
+    stage = profile_stage("write_urlset_xml")
+    digests = {}
+    size = write_urlset_xml(file_path, urls, compress, level, lastmods, digests)
+    profile_stage(stage)
+    return os.path.basename(file_path), size, time.perf_counter() - start, time.thread_time() - cpu, digests
+
+class PartWriter:
+    """
+    Numbers and writes urlset parts, inline or on a process/thread pool (workers > 0) so rendering
+    and compression overlap with parsing. Part names are assigned at submit time, so numbering and
+    index order stay deterministic; at most max_pending buffers are in flight at once.
+    blocked_seconds is how long the caller spent inside submit()/close() (writing or backpressure).
+    """
+    def __init__(self, outdir, basename, compress="none", level=6, workers=0, max_pending=None,
+                 kind="process", on_part=None):
+        self.outdir, self.basename = outdir, basename
+        self.on_part = on_part  # called with (part name, digests) as each part is finished
+        self.compress, self.level = compress, level
+        self.part_names = []
+        self.raw_bytes, self.write_seconds, self.blocked_seconds = 0, 0.0, 0.0
+        self.write_cpu_seconds = 0.0
+        self.part_bytes = {}  # part name -> uncompressed bytes written
+        self.digests = {}  # part name -> MD5/CRC32C of the bytes written
+        self.pool = None
+        if workers > 0:
+            from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+            self.pool = (ThreadPoolExecutor if kind == "thread" else ProcessPoolExecutor)(workers)
+        self.max_pending = max_pending or 2 * max(workers, 1)
+        self.pending = deque()
+
+    def submit(self, urls, part_name=None, lastmods=None):
+        part_name = part_name or part_filename(self.basename, len(self.part_names) + 1, self.compress)
+        self.part_names.append(part_name)
+        args = (os.path.join(self.outdir, part_name), urls, self.compress, self.level, lastmods)
+        start = time.perf_counter()
+        if self.pool is None:
+            self._record(_write_part(*args))
+        else:
+            while len(self.pending) >= self.max_pending:
+                self._record(self.pending.popleft().result())
+            self.pending.append(self.pool.submit(_write_part, *args))
+        self.blocked_seconds += time.perf_counter() - start
+        return part_name
+
+    def _record(self, result):
+        name, size, seconds, cpu, digests = result
+        self.raw_bytes += size
+        self.write_seconds += seconds
+        self.write_cpu_seconds += cpu
+        self.part_bytes[name] = size
+        self.digests[name] = digests
+        if self.on_part is not None:
+            self.on_part(name, digests)
+
+    def close(self):
+        start = time.perf_counter()
+        while self.pending:
+            self._record(self.pending.popleft().result())
+        self.blocked_seconds += time.perf_counter() - start
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return self.part_names
+
+# W3C Datetime forms accepted by the sitemap protocol (YYYY-MM-DD with optional time and zone)
+_W3C_DATETIME_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2}))?")
+
+def clean_lastmod(value):
+    # Feed lastmod value if it is a valid W3C datetime, else "" (the writer then uses today)
+    value = (value or "").strip()
+    return value if _W3C_DATETIME_RE.fullmatch(value) else ""
+
+LASTMOD_STATE_NAME = ".sitemap-lastmod.bin"
+
+class ContentLastmods:
+    """
+    Derive lastmod from a hash of selected feed columns: a URL keeps the date it last changed
+    until the hashed values differ. State is one packed 64-bit word per URL (44-bit content
+    hash, 20-bit day ordinal) keyed by url_hash64, persisted in OUTDIR/.sitemap-lastmod.bin.
+    The previous run's state is held as sorted numpy key/value arrays searched a batch at a time;
+    this run's is appended to arrays, so either costs 16 bytes per URL.
+    """
+    def __init__(self, path):
+        import numpy as np
+        self.np = np
+        self.path = path
+        self.today = np.uint64(datetime.datetime.now(datetime.UTC).date().toordinal())
+        self.previous_keys = self.previous_values = np.zeros(0, dtype=np.uint64)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                n = int.from_bytes(f.read(8), "little")
+                keys = np.fromfile(f, dtype="<u8", count=n)
+                values = np.fromfile(f, dtype="<u8", count=n)
+            # save() writes keys sorted; older state files are in feed order
+            order = np.argsort(keys, kind="stable")
+            self.previous_keys, self.previous_values = keys[order], values[order]
+        self.keys, self.values = array("Q"), array("Q")
+        self.dates = {}
+        self.changed = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lastmods(self, urls, columns):
+        # lastmod per URL of a batch; columns holds one list of values per hashed column
+        np = self.np
+        keys = np.fromiter((url_hash64(url) for url in urls), dtype=np.uint64, count=len(urls))
+        content = np.fromiter((int.from_bytes(hashlib.blake2b("\x1f".join(values).encode("utf-8"),
+                                                              digest_size=8).digest(), "little") >> 20
+                               for values in zip(*columns)), dtype=np.uint64, count=len(urls))
+        packed = (content << np.uint64(20)) | self.today
+        if len(self.previous_keys):
+            at = np.minimum(np.searchsorted(self.previous_keys, keys), len(self.previous_keys) - 1)
+            previous = self.previous_values[at]
+            same = (self.previous_keys[at] == keys) & (previous >> np.uint64(20) == content)
+            packed[same] = previous[same]
+            self.changed += len(urls) - int(np.count_nonzero(same))
+        else:
+            self.changed += len(urls)
+        self.keys.frombytes(keys.tobytes())
+        self.values.frombytes(packed.tobytes())
+        dates = self.dates
+        for day in set((packed & np.uint64(0xFFFFF)).tolist()) - dates.keys():
+            dates[day] = datetime.date.fromordinal(day).isoformat()
+        return [dates[day] for day in (packed & np.uint64(0xFFFFF)).tolist()]
+
+    def save(self):
+        # URLs missing from this run's feed are dropped from the state
+        np = self.np
+        keys, values = np.frombuffer(self.keys, dtype=np.uint64), np.frombuffer(self.values, dtype=np.uint64)
+        order = np.argsort(keys, kind="stable")
+        with open(self.path, "wb") as f:
+            f.write(len(keys).to_bytes(8, "little"))
+            keys[order].astype("<u8").tofile(f)
+            values[order].astype("<u8").tofile(f)
+
+MANIFEST_NAME = ".sitemap-manifest.json.gz"
+
+def url_hash64(url):
+    return _bytes_hash64(url.encode("utf-8"))
+
+def _bytes_hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def part_digest(hashes, lastmods=None):
+    # Order-independent digest of a part's URL set (and per-URL lastmods, when written)
+    h = hashlib.blake2b(array("Q", sorted(hashes)).tobytes(), digest_size=16)
+    if lastmods is not None:
+        h.update("\n".join(sorted(f"{k:016x} {m}" for k, m in zip(hashes, lastmods))).encode("utf-8"))
+    return h.hexdigest()
+
+MANIFEST_PART_KEYS = ("number", "name", "digest", "lastmod", "hashes")
+
+def load_manifest(outdir, name=MANIFEST_NAME):
+    # None when missing or unreadable; the build then starts over as a full rebuild
+    path = os.path.join(outdir, name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != 1 or not all(k in part for part in manifest["parts"]
+                                                    for k in MANIFEST_PART_KEYS):
+            raise ValueError("unexpected layout")
+    except (OSError, EOFError, ValueError, AttributeError, KeyError, TypeError) as e:
+        print(f"incremental: ignoring unreadable {path} ({e}); rebuilding every part")
+        return None
+    return manifest
+
+def save_manifest(outdir, manifest, name=MANIFEST_NAME):
+    with gzip.GzipFile(os.path.join(outdir, name), mode="wb", mtime=0) as f:
+        f.write(json.dumps(manifest, separators=(",", ":")).encode("utf-8"))
+
+class IncrementalUrls:
+    """
+    The deduped URLs of an incremental build, held as what planning needs: a url_hash64 and the
+    <url> entry size per URL (plus its lastmod, when the build writes them). The URL strings are
+    spilled to a temporary file and read back only for the parts that get rewritten.
+    """
+    def __init__(self, with_lastmods=False, spool_dir=None):
+        import tempfile
+        self.spill = tempfile.TemporaryFile(prefix="sitemap-urls-", dir=spool_dir)
+        self.hashes, self.sizes, self.offsets = array("Q"), array("I"), array("Q", [0])
+        self.lastmods = [] if with_lastmods else None
+        self._dates = {}  # one string object per distinct lastmod
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def append(self, url, lastmod, size):
+        data = url.encode("utf-8")
+        self.spill.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.hashes.append(_bytes_hash64(data))
+        self.sizes.append(size)
+        if self.lastmods is not None:
+            self.lastmods.append(self._dates.setdefault(lastmod, lastmod))
+
+    def strings(self, rows):
+        # URL strings for rows (ascending within runs); each run of consecutive rows is one read
+        f, offsets, out = self.spill, self.offsets, []
+        i = 0
+        while i < len(rows):
+            k = i + 1
+            while k < len(rows) and rows[k] == rows[k - 1] + 1:
+                k += 1
+            base = offsets[rows[i]]
+            f.seek(base)
+            data = f.read(offsets[rows[k - 1] + 1] - base)
+            out.extend(data[offsets[j] - base:offsets[j + 1] - base].decode("utf-8") for j in rows[i:k])
+            i = k
+        return out
+
+    def close(self):
+        self.spill.close()
+
+def plan_incremental(urls, manifest, basename, per_file, compress="none", max_bytes=MAX_SITEMAP_BYTES):
+    """
+    Assign URLs to parts for an incremental build. URLs listed in the previous manifest stay in
+    their part, new URLs fill the room freed by removed ones (in part order, within both per_file
+    and max_bytes) and then new parts. `urls` is an IncrementalUrls; only its hashes and entry
+    sizes are consulted.
+    Returns [{"number", "name", "rows", "bytes", "previous"}] for every non-empty part ("rows"
+    index into `urls`); a manifest written with other settings is ignored, which amounts to a full
+    rebuild.
+    """
+    import numpy as np
+    settings = {"basename": basename, "per_file": per_file, "compress": compress, "max_bytes": max_bytes}
+    fill = PartAccumulator(per_file, max_bytes)
+    new_part = lambda number, name, previous: {"number": number, "name": name, "rows": array("Q"),
+                                               "bytes": 0, "previous": previous}
+    hashes = np.frombuffer(urls.hashes, dtype=np.uint64)
+    sizes = np.frombuffer(urls.sizes, dtype=np.uint32)
+    owner = np.full(len(hashes), -1, dtype=np.int64)
+    parts = []
+    if manifest and manifest.get("settings") == settings and manifest["parts"]:
+        known = [np.frombuffer(base64.b64decode(entry["hashes"]), dtype=np.uint64) for entry in manifest["parts"]]
+        parts = [new_part(entry["number"], entry["name"], entry) for entry in manifest["parts"]]
+        # Sorted previous hashes with their part, looked up for the whole feed at once
+        known_parts = np.repeat(np.arange(len(known)), [len(k) for k in known])
+        known = np.concatenate(known)
+        order = np.argsort(known)
+        known, known_parts = known[order], known_parts[order]
+        pos = np.minimum(np.searchsorted(known, hashes), max(len(known) - 1, 0))
+        hit = known[pos] == hashes if len(known) else np.zeros(len(hashes), dtype=bool)
+        owner[hit] = known_parts[pos[hit]]
+    # Rows grouped by owning part (-1: fresh), feed order within each group
+    rows = np.argsort(owner, kind="stable")
+    bounds = np.searchsorted(owner[rows], np.arange(-1, len(parts) + 1))
+    for i, part in enumerate(parts):
+        kept = rows[bounds[i + 1]:bounds[i + 2]]
+        part["rows"].frombytes(kept.astype(np.uint64).tobytes())
+        part["bytes"] = int(sizes[kept].sum())
+    fresh = rows[bounds[0]:bounds[1]].tolist()
+    del owner, rows
+
+    # Fresh URLs top up the previous parts in order, then go to new parts
+    nxt, current = 0, None
+    number = max((part["number"] for part in parts), default=0)
+    for j in fresh:
+        size = urls.sizes[j]
+        if size > fill.budget:
+            check_entry_size(urls.strings([j])[0], size, fill.budget)
+        while current is None or not fill.fits(size):
+            if current is not None:
+                current["bytes"] = fill.size
+            if nxt == len(parts):
+                number += 1
+                parts.append(new_part(number, part_filename(basename, number, compress), None))
+            current, nxt = parts[nxt], nxt + 1
+            fill.start(current["rows"], current["bytes"])
+        fill.add(j, None, size)
+    if current is not None:
+        current["bytes"] = fill.size
+    return [part for part in parts if part["rows"]], settings
+
+def write_incremental(outdir, writer, urls, plan, settings, previous, manifest_name=MANIFEST_NAME):
+    """
+    Write only parts whose URL set changed; drop files of parts that emptied; save the new manifest.
+    Each manifest entry records the part's MD5 and sizes, so an unchanged part counts as published
+    without its file in outdir (only manifests from before MD5s were recorded need the file).
+    Returns (manifest entries, number of parts rewritten).
+    """
+    now = utc_timestamp()
+    entries, written = [], []
+    for part in plan:
+        hashes = [urls.hashes[j] for j in part["rows"]]
+        lastmods = None if urls.lastmods is None else [urls.lastmods[j] for j in part["rows"]]
+        digest = part_digest(hashes, lastmods)
+        prev = part["previous"]
+        path = os.path.join(outdir, part["name"])
+        unchanged = (prev is not None and prev["digest"] == digest
+                     and ("md5" in prev or os.path.exists(path)))
+        entry = {"number": part["number"], "name": part["name"], "digest": digest,
+                 "lastmod": prev["lastmod"] if unchanged else now,
+                 "hashes": base64.b64encode(array("Q", hashes).tobytes()).decode("ascii")}
+        if not unchanged:
+            writer.submit(urls.strings(part["rows"]), part["name"], lastmods)
+            written.append(entry)
+        elif "md5" in prev:
+            entry.update({k: prev[k] for k in ("md5", "bytes", "file_bytes") if k in prev})
+        else:
+            entry.update(md5=file_md5(path), file_bytes=os.path.getsize(path))
+        entries.append(entry)
+    writer.close()
+    for entry in written:
+        entry.update(md5=writer.digests[entry["name"]]["md5"], bytes=writer.part_bytes[entry["name"]],
+                     file_bytes=os.path.getsize(os.path.join(outdir, entry["name"])))
+    live = {e["name"] for e in entries}
+    for entry in (previous or {}).get("parts", []):
+        path = os.path.join(outdir, entry["name"])
+        if entry["name"] not in live and os.path.exists(path):
+            os.remove(path)
+    save_manifest(outdir, {"version": 1, "settings": settings, "parts": entries}, manifest_name)
+    return entries, len(written)
+
+def parse_shard(text):
+    # "i/N" -> (i, N), 0 <= i < N
+    try:
+        index, count = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {text!r}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in 0..{count - 1}, got {index}")
+    return index, count
+
+def shard_name(name, shard):
+    # Per-shard file name for state files, so shards can share an output prefix:
+    # ".sitemap-manifest.json.gz" -> ".sitemap-manifest-shard1-of-4.json.gz"
+    if shard is None:
+        return name
+    stem, dot, ext = name.lstrip(".").partition(".")
+    return f"{name[:len(name) - len(name.lstrip('.'))]}{stem}-shard{shard[0]}-of-{shard[1]}{dot}{ext}"
+
+def shard_filter(urls, extras, shard):
+    # Keep this shard's hash partition; identical URLs always land in the same shard, so per-shard
+    # dedup is globally correct
+    index, count = shard
+    keep = [i for i, url in enumerate(urls) if url_hash64(url) % count == index]
+    if len(keep) == len(urls):
+        return urls, extras
+    return [urls[i] for i in keep], [[col[i] for i in keep] for col in extras]
+
+def shard_manifest_name(shard):
+    return f".sitemap-shard{shard[0]}-of-{shard[1]}.json"
+
+def save_shard_manifest(outdir, shard, part_names, part_lastmods, urls):
+    # What merge-index needs from one shard: its parts, in order, with their index lastmods
+    path = os.path.join(outdir, shard_manifest_name(shard))
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "shard": shard[0], "shards": shard[1], "urls": urls, "parts": part_names,
+                   "lastmods": part_lastmods or [utc_timestamp()] * len(part_names)}, f, indent=1)
+    return path
+
+def load_shard_manifests(paths):
+    # Shard manifests (files, or directories holding them) ordered by shard; all N must be present
+    manifests = {}
+    for path in paths:
+        files = ([os.path.join(path, n) for n in sorted(os.listdir(path))
+                  if re.fullmatch(r"\.sitemap-shard\d+-of-\d+\.json", n)] if os.path.isdir(path) else [path])
+        for file in files:
+            with open(file, encoding="utf-8") as f:
+                m = json.load(f)
+            if m["shard"] in manifests:
+                raise ValueError(f"Shard {m['shard']} given twice ({file})")
+            manifests[m["shard"]] = m
+    counts = {m["shards"] for m in manifests.values()}
+    if len(counts) != 1:
+        raise ValueError(f"Shard manifests disagree on the shard count: {sorted(counts)}" if counts
+                         else "No shard manifests found")
+    count = counts.pop()
+    missing = sorted(set(range(count)) - set(manifests))
+    if missing:
+        raise ValueError(f"Missing shard manifests for shards {missing} of {count}")
+    return [manifests[i] for i in range(count)]
+
+def merge_index_main(argv):
+    p = argparse.ArgumentParser(prog="generate_sitemaps.py merge-index",
+                                description="Write the sitemap index for a sharded build from its shard manifests")
+    p.add_argument("manifests", nargs="+", help="Shard manifests, or directories containing them")
+    p.add_argument("--outdir", required=True, help="Output directory for the index")
+    p.add_argument("--public-base-url", required=True, help="Base URL where sitemaps are hosted")
+    p.add_argument("--index-name", default="sitemap-index.xml", help="Sitemap index filename")
+    p.add_argument("--compress", choices=COMPRESSIONS, default="none",
+                   help="gzip the index when --index-name ends in .gz")
+    p.add_argument("--compress-level", type=int, choices=range(1, 10), default=6, metavar="1-9")
+    args = p.parse_args(argv)
+    try:
+        shards = load_shard_manifests(args.manifests)
+    except ValueError as e:
+        p.error(str(e))
+    part_names = [name for m in shards for name in m["parts"]]
+    part_lastmods = [lastmod for m in shards for lastmod in m["lastmods"]]
+    os.makedirs(args.outdir, exist_ok=True)
+    index_path = os.path.join(args.outdir, args.index_name)
+    index_compress = args.compress if args.index_name.endswith(".gz") else "none"
+    write_index_xml(index_path, part_names, args.public_base_url, index_compress, args.compress_level,
+                    part_lastmods)
+    print(f"Merged {len(shards)} shards ({sum(m['urls'] for m in shards)} URLs, {len(part_names)} parts) "
+          f"into {index_path}")
+
+def file_md5(path):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return base64.b64encode(h.digest()).decode("ascii")
+
+def object_headers(name, cache_control):
+    # Metadata set with each upload, replacing a separate setmeta pass
+    headers = {"Cache-Control": cache_control}
+    if name.endswith(".xml") or name.endswith(".xml.gz"):
+        headers["Content-Type"] = "application/xml; charset=utf-8"
+        if name.endswith(".gz"):
+            headers["Content-Encoding"] = "gzip"
+    else:
+        headers["Content-Type"] = "application/octet-stream"
+    return headers
+
+class LocalStorage:
+    """Directory-backed object store (for tests and dry runs); metadata goes to NAME.meta.json."""
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, name, path, headers, digests):
+        shutil.copyfile(path, os.path.join(self.root, name))
+        with open(os.path.join(self.root, name + ".meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"headers": headers, **digests}, f, indent=2)
+
+    def delete(self, name):
+        for suffix in ("", ".meta.json"):
+            if os.path.exists(os.path.join(self.root, name + suffix)):
+                os.remove(os.path.join(self.root, name + suffix))
+
+    def close(self):
+        pass
+
+class GCSStorage:
+    """
+    Google Cloud Storage via the JSON API over keep-alive connections (one per upload thread).
+    Each object is a single multipart upload carrying contentType/contentEncoding/cacheControl and
+    the MD5/CRC32C computed at write time, which GCS verifies. `endpoint` can point at a fake-GCS
+    stand-in; the token comes from GCS_OAUTH_TOKEN or `gcloud auth print-access-token`.
+    """
+    def __init__(self, bucket, prefix="", endpoint="https://storage.googleapis.com", token=None):
+        import http.client
+        self.http = http.client
+        self.bucket, self.prefix = bucket, prefix.strip("/")
+        self.endpoint = urlparse(endpoint)
+        self.token = token if token is not None else os.environ.get("GCS_OAUTH_TOKEN") or self._gcloud_token()
+        self.local = threading.local()
+        self.connections = []
+
+    @staticmethod
+    def _gcloud_token():
+        import subprocess
+        try:
+            return subprocess.run(["gcloud", "auth", "print-access-token"], check=True,
+                                  capture_output=True, text=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            cls = self.http.HTTPSConnection if self.endpoint.scheme == "https" else self.http.HTTPConnection
+            conn = self.local.conn = cls(self.endpoint.netloc, timeout=120)
+            self.connections.append(conn)
+        return conn
+
+    def _request(self, method, path, body=None, headers=None, ok=(200,)):
+        headers = dict(headers or {})
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        for attempt in range(3):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, self.http.HTTPException):
+                conn.close()
+                if attempt == 2:
+                    raise
+                continue
+            if resp.status in ok:
+                return data
+            if resp.status < 500 or attempt == 2:
+                raise RuntimeError(f"GCS {method} {path} failed: {resp.status} {data[:200]!r}")
+            time.sleep(2 ** attempt)
+
+    def _object(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def put(self, name, path, headers, digests):
+        meta = {"name": self._object(name), "contentType": headers["Content-Type"],
+                "cacheControl": headers["Cache-Control"], "md5Hash": digests["md5"]}
+        if "Content-Encoding" in headers:
+            meta["contentEncoding"] = headers["Content-Encoding"]
+        if "crc32c" in digests:
+            meta["crc32c"] = digests["crc32c"]
+        boundary = "sitemap-" + hashlib.md5(name.encode("utf-8")).hexdigest()
+        with open(path, "rb") as f:
+            media = f.read()
+        body = (f"--{boundary}\r\nContent-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(meta)}\r\n--{boundary}\r\nContent-Type: {headers['Content-Type']}\r\n\r\n"
+                ).encode("utf-8") + media + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        base = self.endpoint.path.rstrip("/")
+        self._request("POST", f"{base}/upload/storage/v1/b/{quote(self.bucket, safe='')}/o?uploadType=multipart",
+                      body, {"Content-Type": f"multipart/related; boundary={boundary}"})
+
+    def delete(self, name):
+        base = self.endpoint.path.rstrip("/")
+        self._request("DELETE", f"{base}/storage/v1/b/{quote(self.bucket, safe='')}/o/"
+                                f"{quote(self._object(name), safe='')}", ok=(204, 404))
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+
+def open_storage(dest, endpoint=None):
+    # gs://bucket/prefix -> GCSStorage; file:///dir or a plain path -> LocalStorage
+    u = urlparse(dest)
+    if u.scheme == "gs":
+        return GCSStorage(u.netloc, u.path, endpoint or "https://storage.googleapis.com")
+    if u.scheme in ("", "file"):
+        return LocalStorage(u.path if u.scheme else dest)
+    raise ValueError(f"Unsupported upload destination {dest!r}; expected gs://bucket/prefix or a directory")
+
+def upload_changed(outdir, storage, manifest_path, digests=None, workers=8,
+                   cache_control="public, max-age=3600", kept=None):
+    """
+    Upload the files in outdir whose MD5 differs from the cached remote manifest (name -> MD5)
+    and delete objects the manifest lists but outdir no longer has. MD5s come from `digests`
+    (computed while writing) and are only recomputed for files written elsewhere. `kept` (name ->
+    MD5) lists objects already published that outdir need not hold (unchanged incremental parts).
+    Returns (uploaded names, deleted names).
+    """
+    digests = digests or {}
+    previous = load_upload_manifest(manifest_path)
+    local = {}
+    for name in sorted(os.listdir(outdir)):
+        path = os.path.join(outdir, name)
+        if os.path.isfile(path):
+            d = digests.get(name) or {"md5": file_md5(path)}
+            local[name] = d
+    changed = [n for n, d in local.items() if previous.get(n) != d["md5"]]
+    for name, md5 in (kept or {}).items():
+        local.setdefault(name, {"md5": md5})
+    deleted = [n for n in previous if n not in local]
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max(workers, 1)) as pool:
+        list(pool.map(lambda n: storage.put(n, os.path.join(outdir, n), object_headers(n, cache_control), local[n]),
+                      changed))
+        list(pool.map(storage.delete, deleted))
+    storage.close()
+    save_upload_manifest(manifest_path, {n: d["md5"] for n, d in local.items()})
+    return changed, deleted
+
+def default_upload_manifest(outdir):
+    return os.path.join(os.path.dirname(os.path.abspath(outdir)), ".upload-manifest.json")
+
+def upload_manifest_path(args):
+    # One upload manifest per shard: shards publishing to the same prefix must not see each other's
+    # objects as stale
+    head, name = os.path.split(args.upload_manifest or default_upload_manifest(args.outdir))
+    return os.path.join(head, shard_name(name, args.shard))
+
+def load_upload_manifest(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_upload_manifest(path, md5s):
+    if path:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(md5s, f, indent=0, sort_keys=True)
+
+class FileSystemSink:
+    """Builder sink writing each sitemap file into a directory."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.uncommitted = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, name):
+        self.uncommitted.add(name)
+        return open(os.path.join(self.directory, name), "wb", buffering=1 << 20)
+
+    def commit(self, name, digests):
+        self.uncommitted.discard(name)
+
+    def abort(self):
+        # Remove files opened but never committed (a part cut short by an error)
+        for name in self.uncommitted:
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+        self.uncommitted.clear()
+
+class _MemoryFile(io.BytesIO):
+    def __init__(self, files, name):
+        super().__init__()
+        self.files, self.name = files, name
+
+    def close(self):
+        if not self.closed:
+            self.files[self.name] = self.getvalue()
+        super().close()
+
+class MemorySink:
+    """Builder sink keeping each finished file's bytes in `files` (name -> bytes)."""
+    def __init__(self):
+        self.files = {}
+        self.uncommitted = set()
+
+    def open(self, name):
+        self.uncommitted.add(name)
+        return _MemoryFile(self.files, name)
+
+    def commit(self, name, digests):
+        self.uncommitted.discard(name)
+
+    def abort(self):
+        for name in self.uncommitted:
+            self.files.pop(name, None)
+        self.uncommitted.clear()
+
+class ObjectStoreSink:
+    """
+    Builder sink uploading each finished file to a storage backend (GCSStorage, LocalStorage) with
+    its headers and write-time digests. Files are spooled to a temporary file one at a time.
+    """
+    def __init__(self, storage, cache_control="public, max-age=3600", spool_dir=None):
+        self.storage, self.cache_control, self.spool_dir = storage, cache_control, spool_dir
+        self.spooled = {}
+
+    def open(self, name):
+        import tempfile
+        f = tempfile.NamedTemporaryFile(prefix="sitemap-", dir=self.spool_dir, delete=False)
+        self.spooled[name] = f.name
+        return f
+
+    def commit(self, name, digests):
+        path = self.spooled.pop(name)
+        try:
+            self.storage.put(name, path, object_headers(name, self.cache_control), digests)
+        finally:
+            os.remove(path)
+
+    def abort(self):
+        # Drop spooled files that were never uploaded
+        for path in self.spooled.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.spooled.clear()
+
+    def close(self):
+        self.storage.close()
+
+class SitemapBuilder:
+    """
+    Streaming sitemap generation for in-process callers: add()/add_many() URLs (optionally with a
+    lastmod), and the builder normalizes, dedups, rolls parts over at per_file URLs or max_bytes,
+    writes each part to `sink` as soon as it fills, and finish() writes the index. Memory is the
+    current part plus the dedup state (`dedup` is a DEDUP_MODES name or a dedup object).
+
+        with SitemapBuilder(FileSystemSink("out"), "https://www.example.com/sitemaps") as builder:
+            builder.add_many(catalog_urls)
+
+    A with block that raises calls close() instead of finish(): no index is written, the sink drops
+    the part it was writing and the dedup state is released.
+    """
+    def __init__(self, sink, public_base_url, basename="sitemap-", index_name="sitemap-index.xml",
+                 per_file=50000, max_bytes=MAX_SITEMAP_BYTES, compress="none", level=6, dedup="set",
+                 normalize=True, batch_size=4096):
+        self.sink, self.public_base_url = sink, public_base_url
+        self.basename, self.index_name = basename, index_name
+        self.compress, self.level = compress, level
+        self.parts = PartAccumulator(per_file, max_bytes, lastmods=True)
+        self.dedup = make_dedup(dedup) if isinstance(dedup, str) else dedup
+        self.normalize, self.batch_size = normalize, batch_size
+        self.today = datetime.datetime.now(datetime.UTC).date().isoformat()
+        self.pending, self.pending_lastmods = [], []
+        self.part_names = []
+        self.finished = self.closed = False
+
+    def _check_open(self):
+        if self.finished:
+            raise RuntimeError("SitemapBuilder.finish() was already called")
+        if self.closed:
+            raise RuntimeError("SitemapBuilder was closed")
+
+    def add(self, url, lastmod=None):
+        # Buffered so dedup and normalization still run a batch at a time
+        self._check_open()
+        self.pending.append(url)
+        self.pending_lastmods.append(lastmod)
+        if len(self.pending) >= self.batch_size:
+            self._flush_pending()
+
+    def add_many(self, urls, lastmods=None):
+        self._flush_pending()
+        batch, batch_lastmods = [], []
+        pairs = zip(urls, lastmods) if lastmods is not None else ((url, None) for url in urls)
+        for url, lastmod in pairs:
+            batch.append(url)
+            batch_lastmods.append(lastmod)
+            if len(batch) >= self.batch_size:
+                self._add_batch(batch, batch_lastmods)
+                batch, batch_lastmods = [], []
+        self._add_batch(batch, batch_lastmods)
+
+    def _flush_pending(self):
+        if self.pending:
+            self._add_batch(self.pending, self.pending_lastmods)
+            self.pending, self.pending_lastmods = [], []
+
+    def _add_batch(self, urls, lastmods):
+        self._check_open()
+        urls = normalize_urls(urls) if self.normalize else list(urls)
+        keep = [i for i, url in enumerate(urls) if url not in NULL_LINKS]
+        urls, lastmods = [urls[i] for i in keep], [lastmods[i] for i in keep]
+        for i in self.dedup.new_indices(urls):
+            url, lastmod = urls[i], lastmods[i]
+            if lastmod is not None and not isinstance(lastmod, str):
+                lastmod = lastmod.isoformat()  # date / datetime
+            lastmod = clean_lastmod(lastmod) if lastmod else ""
+            if done := self.parts.push(url, lastmod, url_entry_bytes(url, lastmod or self.today)):
+                self._write_part(*done)
+
+    def _write_part(self, urls, lastmods):
+        name = part_filename(self.basename, len(self.part_names) + 1, self.compress)
+        digests = {}
+        write_urlset_xml(name, urls, self.compress, self.level, lastmods if any(lastmods) else None, digests,
+                         self.sink.open(name))
+        self.sink.commit(name, digests)
+        self.part_names.append(name)
+
+    def finish(self):
+        # Write the last part and the index, then close(); returns the part names in index order.
+        # Calling it again returns the same names without touching the sink.
+        if self.finished:
+            return self.part_names
+        try:
+            self._flush_pending()
+            if self.parts.items:
+                self._write_part(*self.parts.take())
+            self._check_open()
+            compress = self.compress if self.index_name.endswith(".gz") else "none"
+            digests = {}
+            write_index_xml(self.index_name, self.part_names, self.public_base_url, compress, self.level,
+                            digests=digests, fileobj=self.sink.open(self.index_name))
+            self.sink.commit(self.index_name, digests)
+            self.finished = True
+        finally:
+            self.close()
+        return self.part_names
+
+    def close(self):
+        # Release the dedup state and the sink; files the sink opened but never committed are
+        # discarded. Without finish() no index is written.
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.dedup.close()
+        finally:
+            if not self.finished and hasattr(self.sink, "abort"):
+                self.sink.abort()
+            if hasattr(self.sink, "close"):
+                self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None and not self.finished:
+            self.finish()
+        else:
+            self.close()
+
+class CloudflarePurger:
+    """
+    Purges URLs by file through the Cloudflare API over one keep-alive connection, in batches of
+    `batch` (the per-request file limit), retrying 429/5xx and connection errors with exponential
+    backoff. `endpoint` can point at a local mock.
+    """
+    def __init__(self, zone_id, token, endpoint="https://api.cloudflare.com/client/v4", batch=30,
+                 retries=5, backoff=1.0):
+        import http.client
+        self.http = http.client
+        self.zone_id, self.token, self.batch = zone_id, token, batch
+        self.retries, self.backoff = retries, backoff
+        self.endpoint = urlparse(endpoint)
+        self.conn = None
+        self.requests = 0
+
+    def _conn(self):
+        if self.conn is None:
+            cls = self.http.HTTPSConnection if self.endpoint.scheme == "https" else self.http.HTTPConnection
+            self.conn = cls(self.endpoint.netloc, timeout=60)
+        return self.conn
+
+    def _post(self, files):
+        path = f"{self.endpoint.path.rstrip('/')}/zones/{self.zone_id}/purge_cache"
+        body = json.dumps({"files": files}).encode("utf-8")
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/json"}
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                self._conn().request("POST", path, body=body, headers=headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                self.requests += 1
+                if resp.status == 200 and json.loads(data).get("success"):
+                    return
+                if resp.status != 429 and resp.status < 500:
+                    raise RuntimeError(f"Cloudflare purge failed: {resp.status} {data[:200]!r}")
+                retry_after = resp.getheader("Retry-After")
+            except (OSError, self.http.HTTPException):
+                self.close()
+                if attempt == self.retries:
+                    raise
+            if attempt == self.retries:
+                raise RuntimeError(f"Cloudflare purge still failing after {self.retries} retries")
+            delay = self.backoff * 2 ** attempt
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def purge(self, urls):
+        for i in range(0, len(urls), self.batch):
+            self._post(urls[i:i + self.batch])
+        return (len(urls) + self.batch - 1) // self.batch
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def purge_urls(public_base_url, names):
+    # Public URLs of the changed sitemap files (state dotfiles are never served); the directory
+    # URL is included whenever anything changed since the CDN may cache its listing
+    base = public_base_url.rstrip("/")
+    urls = [f"{base}/{n}" for n in sorted(names) if not n.startswith(".")]
+    return urls + [f"{base}/"] if urls else []
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def write_collapsed(path, stacks):
+    # Collapsed stacks ("root;child;leaf count" per line), as read by flamegraph.pl and speedscope
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in sorted(stacks.items()):
+            if count > 0:
+                f.write(f"{stack} {count}\n")
+
+class CProfileSession:
+    """
+    Deterministic profile with one cProfile.Profile per stage marker, so the collapsed stacks can be
+    rooted at the stage. Collapsed stacks are derived from the caller graph (a callee's time is split
+    across its callers in proportion), in microseconds.
+    """
+    def __init__(self):
+        import cProfile
+        self.cProfile = cProfile
+        self.thread = None
+        self.profiles = {}
+        self.current = None
+
+    def switch(self, stage):
+        # cProfile only follows the thread that enabled it; other threads' markers are ignored
+        if threading.get_ident() != self.thread:
+            return
+        if self.current is not None:
+            self.current.disable()
+        self.current = self.profiles.get(stage or "other")
+        if self.current is None:
+            self.current = self.profiles[stage or "other"] = self.cProfile.Profile()
+        self.current.enable()
+
+    def attach(self):
+        # Profile the calling thread from here on (release() it on the previous thread first)
+        self.thread = threading.get_ident()
+        self.switch(_PROFILE_STAGES.get(self.thread))
+
+    def release(self):
+        if self.current is not None:
+            self.current.disable()
+        self.thread, self.current = None, None
+
+    def start(self):
+        self.attach()
+
+    def stop(self, prefix):
+        import pstats
+        self.release()
+        merged = None
+        stacks = defaultdict(int)
+        for stage, profile in self.profiles.items():
+            st = pstats.Stats(profile)
+            merged = st if merged is None else merged.add(profile)
+            self._collapse(pstats.Stats(profile).stats, stage, stacks)
+        merged.dump_stats(prefix + ".pstats")
+        write_collapsed(prefix + ".collapsed", stacks)
+        return [prefix + ".pstats", prefix + ".collapsed"]
+
+    @staticmethod
+    def _collapse(stats, stage, stacks, min_us=1):
+        # Walks start at functions entered from outside the recorded graph: no callers, or callers
+        # that never ran under this profile (frames already on the stack when it was enabled), for
+        # the share of time not reached through recorded callers. A path stops where it would revisit
+        # a function (generator/recursive cycles such as next <-> iter_raw_links_csv). Self time a
+        # walk cannot reach (cycles with no entry, cut edges, pruned paths) goes directly under the
+        # stage, so the collapsed total equals the pstats total.
+        callees = defaultdict(list)
+        for func, (_, _, _, _, callers) in stats.items():
+            for caller in callers:
+                if caller in stats:
+                    callees[caller].append(func)
+        emitted = defaultdict(float)
+        def label(func):
+            filename, line, name = func
+            return name if filename == "~" else f"{name} ({os.path.basename(filename)}:{line})"
+        def walk(func, path, share, seen):
+            _, _, tt, ct, _ = stats[func]
+            path = f"{path};{label(func)}"
+            us = min(tt * share * 1e6, tt * 1e6 - emitted[func])
+            if us > 0:
+                emitted[func] += us
+                stacks[path] += round(us)
+            for callee in callees[func]:
+                if callee in seen:
+                    continue
+                edge_ct = stats[callee][4][func][3]
+                total = stats[callee][3]
+                sub = min(share * edge_ct / total, 1.0) if total else 0.0
+                if sub * total * 1e6 >= min_us:
+                    walk(callee, path, sub, seen | {callee})
+        for func, (_, _, _, ct, callers) in stats.items():
+            recorded = sum(edge[3] for caller, edge in callers.items() if caller in stats)
+            share = 1.0 if not ct else max(1.0 - recorded / ct, 0.0)
+            if not any(caller in stats for caller in callers) or share * ct * 1e6 >= min_us:
+                walk(func, f"[{stage}]", share if callers else 1.0, {func})
+        for func, (_, _, tt, _, _) in stats.items():
+            rest = tt * 1e6 - emitted[func]
+            if rest >= 0.5:
+                stacks[f"[{stage}];{label(func)}"] += round(rest)
+
+class SamplingSession:
+    """
+    Statistical profile: a background thread snapshots stacks each `interval` seconds via
+    sys._current_frames() -- the attached thread always, other threads only inside a stage marker,
+    so idle pool workers stay out. Stacks are rooted at the stage; counts are samples. Overhead does
+    not depend on call counts, so hot loops stay undistorted.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread = None
+        self.stacks = defaultdict(int)
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def switch(self, stage):
+        pass
+
+    def attach(self):
+        self.thread = threading.get_ident()
+
+    def release(self):
+        self.thread = None
+
+    def start(self):
+        self.attach()
+        self.sampler.start()
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self.done.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                stage = _PROFILE_STAGES.get(ident)
+                if ident == me or (stage is None and ident != self.thread):
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if ident not in names:
+                    names[ident] = next((t.name for t in threading.enumerate() if t.ident == ident), str(ident))
+                root = f"[{stage or 'other'}];{names[ident]}"
+                self.stacks[";".join([root, *reversed(frames)])] += 1
+
+    def stop(self, prefix):
+        self.done.set()
+        self.sampler.join()
+        write_collapsed(prefix + ".collapsed", self.stacks)
+        # Self samples per function, the sampling analogue of pstats' tottime
+        leaves = defaultdict(int)
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        with open(prefix + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"{total} samples every {self.interval * 1000:g} ms; self samples per function\n")
+            for func, count in sorted(leaves.items(), key=lambda kv: -kv[1])[:100]:
+                f.write(f"{count:>8} {count / total:7.2%}  {func}\n")
+        return [prefix + ".collapsed", prefix + ".txt"]
+
+def profile_call(kind, prefix, fn, *args, interval=0.005):
+    # Run fn(*args) under --profile and write the profile files next to `prefix`
+    global _PROFILER
+    session = CProfileSession() if kind == "cprofile" else SamplingSession(interval)
+    _PROFILER = session
+    session.start()
+    try:
+        return fn(*args)
+    finally:
+        _PROFILER = None
+        files = session.stop(prefix)
+        print(f"profile[{kind}]: wrote {', '.join(files)}")
 
 def main():
-    p = argparse.ArgumentParser()
+    if sys.argv[1:2] == ["merge-index"]:
+        return merge_index_main(sys.argv[2:])
+    p = argparse.ArgumentParser(epilog="Sharded builds: run with --shard i/N per shard, then "
+                                       "`generate_sitemaps.py merge-index MANIFEST... --outdir ...` for the index.")
     p.add_argument("--csv", required=True, help="CSV URL or path")
     p.add_argument("--outdir", required=True, help="Output directory")
     p.add_argument("--basename", default="sitemap-", help="Base name for part files")
     p.add_argument("--per-file", type=int, default=50000, help="URLs per sitemap file (<= 50k)")
+    p.add_argument("--max-bytes", type=int, default=MAX_SITEMAP_BYTES,
+                   help="Uncompressed bytes per sitemap file (<= 50 MiB); parts roll over on whichever "
+                        "of --per-file/--max-bytes is hit first")
     p.add_argument("--public-base-url", required=True, help="Base URL where sitemaps are hosted")
     p.add_argument("--index-name", default="sitemap-index.xml", help="Sitemap index filename")
     p.add_argument("--link-column", default="link", help="CSV column containing URLs")
+    p.add_argument("--reader", choices=READERS, default="csv",
+                   help="CSV backend: stdlib csv stream (default), pandas chunks or pyarrow columnar")
+    p.add_argument("--dedup", choices=DEDUP_MODES, default="set",
+                   help="Dedup strategy: exact string set (default), exact 64/128-bit hash table, "
+                        "disk-spilling 128-bit hashes, or probabilistic bloom filter")
+    p.add_argument("--dedup-capacity", type=int, default=None,
+                   help="hash64/hash128: expected unique URLs (presizes the table); disk: hashes kept in "
+                        "memory before spilling; bloom: expected unique URLs")
+    p.add_argument("--dedup-error", type=float, default=1e-6, help="bloom: false-positive rate")
+    p.add_argument("--dedup-dir", default=None, help="disk: directory for spilled runs (default: temp)")
+    p.add_argument("--compress", choices=COMPRESSIONS, default="none",
+                   help="Write parts as .xml.gz (the index too if --index-name ends in .gz)")
+    p.add_argument("--compress-level", type=int, default=6, choices=range(1, 10), metavar="1-9",
+                   help="gzip compression level (1 fastest, 9 smallest)")
+    p.add_argument("--workers", type=int, default=0,
+                   help="Write parts on a pool of N workers while parsing continues (0 = inline)")
+    p.add_argument("--worker-kind", choices=("process", "thread"), default="process",
+                   help="Pool type for --workers (threads suit gzip, which releases the GIL)")
+    p.add_argument("--parse-workers", type=int, default=0,
+                   help="Parse local, uncompressed feeds with the csv reader on this many processes "
+                        "(record-aligned byte ranges; output is identical to the sequential reader)")
+    p.add_argument("--prefetch", type=int, default=0,
+                   help="Read the feed ahead on a background thread, buffering up to N 1 MiB blocks")
+    p.add_argument("--lastmod-column", default=None,
+                   help="CSV column with each URL's W3C lastmod (invalid/empty values fall back)")
+    p.add_argument("--lastmod-hash-columns", default=None,
+                   help="Comma-separated columns (e.g. price,availability) whose hash decides lastmod: "
+                        f"it only moves when they change (state in OUTDIR/{LASTMOD_STATE_NAME})")
+    p.add_argument("--feed-cache", default=None,
+                   help="Cache dir for the feed: conditional download (ETag/Last-Modified) and skip the "
+                        "whole build when the feed and options match the last successful build")
+    p.add_argument("--upload", default=None, metavar="DEST",
+                   help="After building, upload changed files to gs://bucket/prefix (or a local directory) "
+                        "and delete objects no longer produced")
+    p.add_argument("--upload-manifest", default=None,
+                   help="Cached remote manifest (name -> MD5) used to skip unchanged objects "
+                        "(default: OUTDIR/../.upload-manifest.json; --shard builds keep one per shard)")
+    p.add_argument("--upload-workers", type=int, default=8, help="Concurrent upload connections")
+    p.add_argument("--upload-endpoint", default=None, help="GCS JSON API endpoint (e.g. a fake-GCS server)")
+    p.add_argument("--cache-control", default="public, max-age=3600", help="Cache-Control set on uploaded objects")
+    p.add_argument("--purge-list", default=None,
+                   help="Write the public URLs of sitemap files whose bytes changed this run (one per line)")
+    p.add_argument("--purge", action="store_true",
+                   help="Purge the changed URLs from Cloudflare (zone/token from CF_ZONE_ID/CF_API_TOKEN)")
+    p.add_argument("--purge-endpoint", default="https://api.cloudflare.com/client/v4",
+                   help="Cloudflare API base URL (e.g. a local mock)")
+    p.add_argument("--purge-batch", type=int, default=30, help="URLs per purge request")
+    p.add_argument("--pipeline", action="store_true",
+                   help="With --upload: upload each part as soon as it is written and purge as soon as the "
+                        "index is up, overlapping build, upload and purge (a remote --csv is also prefetched)")
+    p.add_argument("--stats-json", default=None, metavar="PATH",
+                   help="Write a run report: wall/CPU seconds per stage, row/null/duplicate/rewritten "
+                        "counters, bytes per part and peak RSS")
+    p.add_argument("--profile", choices=("cprofile", "sample"), default=None,
+                   help="Profile the run: cprofile (deterministic, writes .pstats) or sample (low overhead); "
+                        "both write collapsed stacks rooted at iter_links/dedup/write_urlset_xml stage markers")
+    p.add_argument("--profile-out", default="sitemap-profile", help="Path prefix for the profile files")
+    p.add_argument("--profile-interval", type=float, default=5.0, help="Sampling interval in ms (--profile sample)")
+    p.add_argument("--shard", type=parse_shard, default=None, metavar="i/N",
+                   help="Build only shard i (0-based) of N: the URLs whose hash falls in partition i. Parts "
+                        "are named BASENAMEshardi-NNNNN and a shard manifest replaces the index "
+                        "(combine them with merge-index)")
+    p.add_argument("--incremental", action="store_true",
+                   help=f"Keep URLs in their previous part and rewrite only changed parts "
+                        f"(state in OUTDIR/{MANIFEST_NAME}; unchanged parts need not be in OUTDIR)")
     args = p.parse_args()
+    try:
+        part_budget(args.max_bytes)
+    except ValueError as e:
+        p.error(f"argument --max-bytes: {e}")
+    run = build
+    if args.pipeline:
+        if not args.upload:
+            p.error("--pipeline needs --upload")
+        if is_remote(args.csv) and not args.prefetch:
+            args.prefetch = 8  # overlap the download with parsing too
+        run = pipeline
+    if args.profile:
+        profile_call(args.profile, args.profile_out, run, args, interval=args.profile_interval / 1000)
+    else:
+        run(args)
 
-    os.makedirs(args.outdir, exist_ok=True)
+def record_build(feed_cache, build_key):
+    # Remember the successful build so an unchanged feed (and options) can skip the next one
+    if build_key:
+        meta = load_feed_meta(feed_cache)
+        meta["last_build"] = build_key
+        save_feed_meta(feed_cache, meta)
+
+def purge_changed(args, changed):
+    # --purge-list / --purge for the public URLs of the changed files; returns a summary line, if any
+    if not (args.purge_list or args.purge):
+        return None
+    urls = purge_urls(args.public_base_url, changed)
+    if args.purge_list:
+        with open(args.purge_list, "w", encoding="utf-8") as f:
+            f.writelines(u + "\n" for u in urls)
+    if args.purge and urls:
+        purger = CloudflarePurger(os.environ["CF_ZONE_ID"], os.environ["CF_API_TOKEN"],
+                                  args.purge_endpoint, args.purge_batch)
+        try:
+            batches = purger.purge(urls)
+        finally:
+            purger.close()
+        return f"purge: {len(urls)} URLs in {batches} requests ({purger.requests} including retries)"
+    return None
 
-    buffer, part_names = [], []
-    part = 1
+async def run_pipeline(args):
+    """
+    --pipeline: build, upload and purge as overlapping stages instead of one after another.
+    build() runs on a worker thread and reports each finished part. Changed parts start uploading
+    at once, up to --upload-workers at a time. The index goes up only after every part it lists.
+    Stale objects are then deleted and the purge is sent while the state files are still syncing.
+    Unchanged files (same MD5 as the upload manifest) are skipped, as with --upload.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    storage = open_storage(args.upload, args.upload_endpoint)
+    manifest_path = upload_manifest_path(args)
+    previous = load_upload_manifest(manifest_path)
+    files = asyncio.Queue()
+    limit = asyncio.Semaphore(max(args.upload_workers, 1))
+    current, changed, deleted = {}, [], []
+    marks, started = {}, time.perf_counter()
 
-    seen = set()
+    async def upload(name, digests):
+        path = os.path.join(args.outdir, name)
+        if not os.path.exists(path):
+            # an unchanged incremental part: published by an earlier run, not restored locally
+            current[name] = digests["md5"]
+            return
+        md5 = digests.get("md5") or await asyncio.to_thread(file_md5, path)
+        if previous.get(name) != md5:
+            async with limit:
+                await asyncio.to_thread(storage.put, name, path, object_headers(name, args.cache_control),
+                                        {**digests, "md5": md5})
+            changed.append(name)
+        current[name] = md5
 
-    for url in iter_links(args.csv, args.link_column):
-        if url in seen:
-            continue
-        seen.add(url)
+    async def delete_stale():
+        deleted.extend(n for n in previous if n not in current and not os.path.exists(os.path.join(args.outdir, n)))
+        await asyncio.gather(*(asyncio.to_thread(storage.delete, n) for n in deleted))
+
+    async def purge():
+        marks["purge_summary"] = await asyncio.to_thread(purge_changed, args, changed + deleted)
+        marks["purged"] = time.perf_counter() - started
+
+    async def publish():
+        parts, purging = [], None
+        while (item := await files.get()) is not None:
+            name, digests = item
+            if name != args.index_name:
+                parts.append(asyncio.create_task(upload(name, digests)))
+                continue
+            await asyncio.gather(*parts)
+            await upload(name, digests)
+            marks["index_uploaded"] = time.perf_counter() - started
+            await delete_stale()
+            purging = asyncio.create_task(purge())
+        await asyncio.gather(*parts)
+        return purging
 
-        buffer.append(url)
-        if len(buffer) >= args.per_file:
-            part_name = f"{args.basename}{part:05d}.xml"
-            write_urlset_xml(os.path.join(args.outdir, part_name), buffer)
-            part_names.append(part_name)
-            buffer.clear()
-            part += 1
+    def on_file(name, digests):
+        loop.call_soon_threadsafe(files.put_nowait, (name, digests))
 
-    if buffer:
-        part_name = f"{args.basename}{part:05d}.xml"
-        write_urlset_xml(os.path.join(args.outdir, part_name), buffer)
-        part_names.append(part_name)
+    profiler = _PROFILER
+    def profiled_build(args, on_file):
+        # --profile follows build() onto its worker thread; the main thread only runs the event loop
+        profiler.attach()
+        try:
+            return build(args, on_file)
+        finally:
+            profiler.release()
 
+    publisher = asyncio.create_task(publish())
+    if profiler is not None:
+        profiler.release()
+    try:
+        build_key = await asyncio.to_thread(build if profiler is None else profiled_build, args, on_file)
+    finally:
+        if profiler is not None:
+            profiler.attach()
+        files.put_nowait(None)
+        purging = await publisher
+    marks["built"] = time.perf_counter() - started
+
+    # State files (manifests, lastmod state, shard manifests) and anything not streamed
+    names = sorted(n for n in os.listdir(args.outdir) if os.path.isfile(os.path.join(args.outdir, n)))
+    await asyncio.gather(*(upload(n, {}) for n in names if n not in current))
+    if build_key is None and args.feed_cache:
+        # skipped build (feed unchanged): what was published stays as it is
+        current = {**previous, **current}
+    elif purging is None:
+        # no index this run (shard build): publish the rest, then purge
+        await delete_stale()
+        await purge()
+    else:
+        await purging
+    storage.close()
+    save_upload_manifest(manifest_path, current)
+    record_build(args.feed_cache, build_key)
+    summary = marks.pop("purge_summary", None)
+    if summary:
+        print(summary)
+    print(f"pipeline: {len(changed)} changed objects uploaded, {len(deleted)} deleted ({args.upload}); "
+          + ", ".join(f"{k} at {v:.2f}s" for k, v in marks.items())
+          + f", done at {time.perf_counter() - started:.2f}s")
+
+def pipeline(args):
+    import asyncio
+    return asyncio.run(run_pipeline(args))
+
+def build(args, on_file=None):
+    os.makedirs(args.outdir, exist_ok=True)
     index_path = os.path.join(args.outdir, args.index_name)
-    write_index_xml(index_path, part_names, args.public_base_url)
+    # A shard's build product is its shard manifest; merge-index writes the index later
+    shard = args.shard
+    if shard is not None:
+        args.basename = f"{args.basename}shard{shard[0]}-"
+        index_path = os.path.join(args.outdir, shard_manifest_name(shard))
+    stats = RunStats()
+    run_start = stats.clock()
+
+    build_key, feed_key, feed_stream = None, None, None
+    if args.feed_cache:
+        start = stats.clock()
+        if is_remote(args.csv):
+            # A changed feed is parsed while it downloads (and is saved to the cache on the way);
+            # the parallel parser maps a local file, so it still waits for the whole download
+            feed, feed_sha256, downloaded = fetch_feed(args.csv, args.feed_cache, stream=args.parse_workers <= 1)
+            if feed_sha256 is None:
+                feed_stream = feed
+                print(f"feed: changed, parsing it while it downloads ({feed.name})")
+            else:
+                args.csv = feed
+                print(f"feed: {'downloaded' if downloaded else 'not modified, using cached copy'} ({args.csv})")
+        else:
+            os.makedirs(args.feed_cache, exist_ok=True)
+            feed_sha256 = file_sha256(args.csv)
+        stats.since("download", start)
+        options = {k: v for k, v in sorted(vars(args).items())
+                   if k not in ("csv", "feed_cache", "workers", "stats_json")
+                   and not k.startswith("profile")}
+        feed_key = lambda sha256: hashlib.sha256(json.dumps([sha256, options]).encode("utf-8")).hexdigest()
+        build_key = feed_sha256 and feed_key(feed_sha256)
+        # With --incremental, the manifest alone stands for the published build
+        published = os.path.exists(index_path) or (
+            args.incremental and os.path.exists(os.path.join(args.outdir, shard_name(MANIFEST_NAME, shard))))
+        if build_key and load_feed_meta(args.feed_cache).get("last_build") == build_key and published:
+            print(f"Feed unchanged since the last successful build; keeping {index_path}")
+            if args.stats_json:
+                save_run_report(args.stats_json, stats, run_start, skipped=True)
+            return
+
+    hash_cols = [c.strip() for c in (args.lastmod_hash_columns or "").split(",") if c.strip()]
+    extra_cols = list(dict.fromkeys(([args.lastmod_column] if args.lastmod_column else []) + hash_cols))
+    lastmod_idx = extra_cols.index(args.lastmod_column) if args.lastmod_column else None
+    hash_idx = [extra_cols.index(c) for c in hash_cols]
+    content = None
+    if hash_cols:
+        content = ContentLastmods(os.path.join(args.outdir, shard_name(LASTMOD_STATE_NAME, shard)))
+
+    parts = PartAccumulator(args.per_file, args.max_bytes, bool(extra_cols))
+    today = datetime.datetime.now(datetime.UTC).date().isoformat()
+    writer = PartWriter(args.outdir, args.basename, args.compress, args.compress_level, args.workers,
+                        kind=args.worker_kind, on_part=on_file)
+
+    dedup = make_dedup(args.dedup, args.dedup_capacity, args.dedup_error, args.dedup_dir)
+    # --incremental: part contents depend on the whole feed, so URLs are held (as hashes and sizes,
+    # the strings spilled to disk) until the end
+    pending = IncrementalUrls(bool(extra_cols), args.dedup_dir) if args.incremental else None
+
+    download = {}
+    parallel = args.parse_workers > 1 and args.reader == "csv" and is_splittable(args.csv)
+    # the parallel parser maps the file itself, so there is nothing to prefetch
+    source = feed_stream or args.csv
+    if args.prefetch and not parallel:
+        source = open_feed(source, args.prefetch, download)
+    ingest_start = time.perf_counter()
+    feed = iter_feed_batches(source, args.link_column, reader=args.reader, extra_cols=extra_cols, stats=stats,
+                             parse_workers=args.parse_workers)
+    for urls, extras in feed:
+        profile_stage("dedup")
+        if shard is not None:
+            urls, extras = shard_filter(urls, extras, shard)
+        start = stats.clock()
+        new = dedup.new_indices(urls)
+        stats.since("dedup", start)
+        stats.counters["duplicates"] += len(urls) - len(new)
+        if content is not None:
+            derived = content.lastmods([urls[i] for i in new], [[extras[k][i] for i in new] for k in hash_idx])
+        for j, i in enumerate(new):
+            url, lastmod = urls[i], ""
+            if extra_cols:
+                # an explicit feed lastmod wins; the content hash is still tracked for the next run
+                lastmod = clean_lastmod(extras[lastmod_idx][i]) if lastmod_idx is not None else ""
+                if content is not None:
+                    lastmod = lastmod or derived[j]
+            size = url_entry_bytes(url, lastmod or today)
+            if pending is not None:
+                check_entry_size(url, size, parts.budget)
+                pending.append(url, lastmod, size)
+            elif done := parts.push(url, lastmod, size):
+                writer.submit(done[0], lastmods=done[1])
+
+    profile_stage(None)
+    ingest_seconds = time.perf_counter() - ingest_start
+    if feed_stream is not None:
+        if feed_stream.raw.sha256 is None:
+            raise RuntimeError(f"The feed download stopped before the end of {args.csv}")
+        build_key = feed_key(feed_stream.raw.sha256)
+
+    part_lastmods, kept = None, {}
+    if pending is not None:
+        start = stats.clock()
+        previous = load_manifest(args.outdir, shard_name(MANIFEST_NAME, shard))
+        plan, settings = plan_incremental(pending, previous, args.basename, args.per_file, args.compress,
+                                          args.max_bytes)
+        stats.since("plan", start)
+        entries, rewritten = write_incremental(args.outdir, writer, pending, plan, settings, previous,
+                                               shard_name(MANIFEST_NAME, shard))
+        pending.close()
+        part_names, part_lastmods = [e["name"] for e in entries], [e["lastmod"] for e in entries]
+        # Unchanged parts stay published as they are, whether or not their files are in outdir
+        kept = {e["name"]: e for e in entries if e["name"] not in writer.part_bytes}
+        print(f"incremental: rewrote {rewritten} of {len(part_names)} part files")
+        if on_file is not None:
+            for name, entry in kept.items():
+                on_file(name, {"md5": entry["md5"]})
+    else:
+        if parts.items:
+            done = parts.take()
+            writer.submit(done[0], lastmods=done[1])
+        part_names = writer.close()
+    # Writer time is summed over the parts (across workers when parallel)
+    stats.add("write", writer.write_seconds, writer.write_cpu_seconds)
+    if download:
+        # background prefetch thread; its CPU is already inside the parse stage's process time
+        stats.add("download", download["busy"])
+    if content is not None:
+        content.save()
+        print(f"lastmod: {content.changed} of {len(content)} URLs new or changed since the last run")
+
+    digests = dict(writer.digests)
+    start = stats.clock()
+    if shard is not None:
+        save_shard_manifest(args.outdir, shard, part_names, part_lastmods, len(dedup))
+    else:
+        index_compress = args.compress if args.index_name.endswith(".gz") else "none"
+        digests[args.index_name] = {}
+        write_index_xml(index_path, part_names, args.public_base_url, index_compress, args.compress_level,
+                        part_lastmods, digests[args.index_name])
+    stats.since("index", start)
+
+    if on_file is not None:
+        # --pipeline: the index is the last file; publishing and recording the build are the caller's
+        if shard is None:
+            on_file(args.index_name, digests[args.index_name])
+    else:
+        if args.upload:
+            start = stats.clock()
+            uploaded, deleted = upload_changed(args.outdir, open_storage(args.upload, args.upload_endpoint),
+                                               upload_manifest_path(args),
+                                               digests, args.upload_workers, args.cache_control,
+                                               {n: e["md5"] for n, e in kept.items()})
+            stats.since("upload", start)
+            print(f"upload: {len(uploaded)} changed objects uploaded, {len(deleted)} deleted ({args.upload})")
+            changed = uploaded + deleted
+        else:
+            # Without an upload manifest to compare against, every file written this run counts as changed
+            changed = list(digests)
+        start = stats.clock()
+        summary = purge_changed(args, changed)
+        stats.since("purge", start)
+        if summary:
+            print(summary)
+        record_build(args.feed_cache, build_key)
 
-    print(f"Generated {len(part_names)} sitemap part files; index at {index_path}")
+    unique_urls = len(dedup)
+    print(f"Generated {len(part_names)} sitemap part files; {'shard manifest' if shard else 'index'} at {index_path}")
+    print(f"dedup[{dedup.name}]: {unique_urls} unique URLs, {dedup.memory_bytes() / 2**20:.1f} MiB in memory"
+          + (f", {dedup.disk_bytes() / 2**20:.1f} MiB on disk" if dedup.disk_bytes() else ""))
+    dedup.close()
+    # Only the parts written this run: under --incremental the unchanged ones were not re-encoded
+    rewritten = [n for n in part_names if n in writer.part_bytes]
+    if args.compress != "none" and rewritten:
+        raw = sum(writer.part_bytes[n] for n in rewritten)
+        written = sum(os.path.getsize(os.path.join(args.outdir, n)) for n in rewritten)
+        print(f"{args.compress} level {args.compress_level}: {raw / 2**20:.1f} MiB -> "
+              f"{written / 2**20:.1f} MiB ({raw / max(written, 1):.1f}x) for the {len(rewritten)}/{len(part_names)} "
+              f"part files written, in {writer.write_seconds:.2f}s of part writing")
+    if download:
+        # parse busy = ingest loop minus time starved for bytes or blocked handing parts to the writer
+        parse_busy = ingest_seconds - download["consumer_wait"] - writer.blocked_seconds
+        print(f"stages: download busy {download['busy']:.2f}s idle {download['idle']:.2f}s (queue full) | "
+              f"parse busy {max(parse_busy, 0):.2f}s, waited {download['consumer_wait']:.2f}s for bytes "
+              f"and {writer.blocked_seconds:.2f}s on the writer | write busy {writer.write_seconds:.2f}s")
+    fast = normalize_stats()
+    if fast["fast_path_ratio"] is not None:
+        print(f"normalize_url fast path: {fast['fast_path_ratio']:.2%} "
+              f"(cache hits {fast['cache_hits']}, misses {fast['cache_misses']}, "
+              f"canonical {fast['canonical']}, urlparse fallbacks {fast['fallback']})")
+    if args.stats_json:
+        parts = {n: {"bytes": kept[n].get("bytes"), "file_bytes": kept[n].get("file_bytes")} if n in kept else
+                 {"bytes": writer.part_bytes.get(n), "file_bytes": os.path.getsize(os.path.join(args.outdir, n))}
+                 for n in part_names}
+        save_run_report(args.stats_json, stats, run_start, parts=parts, unique_urls=unique_urls,
+                        prefetch=download or None, write_blocked_seconds=round(writer.blocked_seconds, 4),
+                        normalize=fast)
+    return build_key
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,115 @@
+"""Shared test fixtures: local http.server stand-ins and a runner for the generate_sitemaps CLI."""
+import contextlib, io, json, sys, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import generate_sitemaps as gs
+
+BASE_URL = "https://www.leeladiamond.com/sitemaps"
+
+
+def start_server(handler, testcase, **state):
+    # Serve `handler` on a free local port until the test ends; `state` becomes server attributes
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    for k, v in state.items():
+        setattr(server, k, v)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    testcase.addCleanup(server.server_close)
+    testcase.addCleanup(server.shutdown)
+    return server
+
+
+class PurgeHandler(BaseHTTPRequestHandler):
+    # Mock Cloudflare API: answers each POST with the next scripted (status, headers) response
+    # (200 with success once the script runs out), records the requests and logs each purged file
+    # name ("" for the directory URL) to `events`
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append({"path": self.path, "auth": self.headers["Authorization"],
+                                     "files": body["files"]})
+        status, headers = self.server.script.pop(0) if self.server.script else (200, {})
+        if status == 200:
+            self.server.events.extend(("purge", url.rsplit("/", 1)[1]) for url in body["files"])
+        data = json.dumps({"success": status == 200}).encode("utf-8")
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_purge_server(testcase, events=None):
+    # A PurgeHandler server and its API base URL (the --purge-endpoint / CloudflarePurger endpoint)
+    server = start_server(PurgeHandler, testcase, requests=[], script=[],
+                          events=events if events is not None else [])
+    return server, f"http://127.0.0.1:{server.server_port}/client/v4"
+
+
+class GCSHandler(BaseHTTPRequestHandler):
+    # Fake GCS JSON API: multipart uploads and deletes against `objects` (name -> {"meta", "media",
+    # "media_type"}). Each request is recorded; a scripted status (popped from `script`) answers it
+    # instead, without touching `objects`
+    protocol_version = "HTTP/1.1"
+
+    def record(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.requests.append({"method": self.command, "path": self.path,
+                                     "auth": self.headers.get("Authorization"),
+                                     "content_type": self.headers.get("Content-Type"), "body": body})
+        return body, self.server.script.pop(0) if self.server.script else None
+
+    def reply(self, status, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body, scripted = self.record()
+        if scripted:
+            return self.reply(scripted, {"error": {"code": scripted}})
+        boundary = self.headers["Content-Type"].split("boundary=", 1)[1].encode("ascii")
+        meta_part, media_part, end = body.split(b"--" + boundary)[1:]
+        if end != b"--\r\n":
+            return self.reply(400, {"error": {"message": "bad multipart body"}})
+        meta = json.loads(meta_part.split(b"\r\n\r\n", 1)[1])
+        headers, media = media_part.split(b"\r\n\r\n", 1)
+        self.server.objects[meta["name"]] = {"meta": meta, "media": media[:-2],
+                                             "media_type": headers.decode("utf-8").split(": ", 1)[1]}
+        self.reply(200, meta)
+
+    def do_DELETE(self):
+        _, scripted = self.record()
+        if scripted:
+            return self.reply(scripted, {"error": {"code": scripted}})
+        name = unquote(self.path.split("/o/", 1)[1])
+        self.reply(204 if self.server.objects.pop(name, None) is not None else 404)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_gcs_server(testcase, path=""):
+    # A GCSHandler server and its endpoint URL (the --upload-endpoint / GCSStorage endpoint)
+    server = start_server(GCSHandler, testcase, objects={}, requests=[], script=[])
+    return server, f"http://127.0.0.1:{server.server_port}{path}"
+
+
+def run_main(*argv):
+    # generate_sitemaps.main() with these command-line arguments; returns what it printed
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        saved, sys.argv = sys.argv, ["generate_sitemaps.py", *argv]
+        try:
+            gs.main()
+        finally:
+            sys.argv = saved
+    return out.getvalue()
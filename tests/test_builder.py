@@ -0,0 +1,112 @@
+import os, re, tempfile, unittest
+from unittest import mock
+import generate_sitemaps as gs
+from helpers import BASE_URL
+
+URLS = [f"https://www.leeladiamond.com/products/ring-{i}" for i in range(2500)]
+
+
+def locs(data):
+    return re.findall(r"<loc>(.*?)</loc>", data.decode("utf-8"))
+
+
+class SitemapBuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def build(self, sink, urls=URLS, **kwargs):
+        with gs.SitemapBuilder(sink, BASE_URL, per_file=1000, batch_size=300, **kwargs) as builder:
+            for url in urls[:700]:
+                builder.add(url)
+            builder.add_many(urls[700:] + urls[:100])  # duplicates are dropped
+        return builder
+
+    def test_part_split(self):
+        sink = gs.MemorySink()
+        builder = self.build(sink)
+        names = ["sitemap-00001.xml", "sitemap-00002.xml", "sitemap-00003.xml"]
+        self.assertEqual(builder.part_names, names)
+        self.assertEqual([len(locs(sink.files[n])) for n in names], [1000, 1000, 500])
+        self.assertEqual([u for n in names for u in locs(sink.files[n])], URLS)
+        self.assertEqual(locs(sink.files["sitemap-index.xml"]), [f"{BASE_URL}/{n}" for n in names])
+
+    def test_max_bytes_split(self):
+        urls = URLS[1000:1025]  # equal lengths: 10 entries fill a part exactly
+        budget = len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + 10 * gs.url_entry_bytes(urls[0], "2024-01-01")
+        sink = gs.MemorySink()
+        builder = self.build(sink, urls, max_bytes=budget)
+        self.assertEqual([len(locs(sink.files[n])) for n in builder.part_names], [10, 10, 5])
+        self.assertEqual([len(sink.files[n]) for n in builder.part_names][:2], [budget, budget])
+
+    def test_sinks_write_the_same_files(self):
+        memory = gs.MemorySink()
+        self.build(memory)
+        directory = os.path.join(self.tmp.name, "fs")
+        self.build(gs.FileSystemSink(directory))
+        remote = os.path.join(self.tmp.name, "remote")
+        spool = os.path.join(self.tmp.name, "spool")
+        os.makedirs(spool)
+        self.build(gs.ObjectStoreSink(gs.LocalStorage(remote), spool_dir=spool))
+        for name, data in memory.files.items():
+            for root in (directory, remote):
+                with open(os.path.join(root, name), "rb") as f:
+                    self.assertEqual(f.read(), data, name)
+        self.assertEqual(os.listdir(spool), [])
+        self.assertEqual(len(os.listdir(directory)), 4)
+
+    def test_finish_is_idempotent(self):
+        sink = gs.MemorySink()
+        builder = self.build(sink)
+        files = dict(sink.files)
+        with mock.patch.object(sink, "open") as opened:
+            self.assertEqual(builder.finish(), builder.part_names)
+        opened.assert_not_called()
+        self.assertEqual(sink.files, files)
+
+    def test_add_after_finish_raises(self):
+        builder = self.build(gs.MemorySink())
+        with self.assertRaisesRegex(RuntimeError, "already called"):
+            builder.add(URLS[0] + "-late")
+        with self.assertRaisesRegex(RuntimeError, "already called"):
+            builder.add_many([URLS[0] + "-late"])
+        self.assertEqual(builder.pending, [])
+
+    def test_exception_in_block_cleans_up(self):
+        directory = os.path.join(self.tmp.name, "fs")
+        dedup = gs.make_dedup("disk", 100, spill_dir=self.tmp.name)
+        with self.assertRaisesRegex(ValueError, "feed broke"):
+            with gs.SitemapBuilder(gs.FileSystemSink(directory), BASE_URL, per_file=1000,
+                                   dedup=dedup) as builder:
+                builder.add_many(URLS)
+                raise ValueError("feed broke")
+        # committed parts stay, no index, dedup spill dir removed
+        self.assertEqual(sorted(os.listdir(directory)), ["sitemap-00001.xml", "sitemap-00002.xml"])
+        self.assertFalse(os.path.exists(dedup.dir))
+        with self.assertRaisesRegex(RuntimeError, "closed"):
+            builder.finish()
+
+    def test_failed_part_write_is_discarded(self):
+        spool = os.path.join(self.tmp.name, "spool")
+        os.makedirs(spool)
+        storage = gs.LocalStorage(os.path.join(self.tmp.name, "remote"))
+        sink = gs.ObjectStoreSink(storage, spool_dir=spool)
+        calls, real = [], gs.write_urlset_xml
+        def write_urlset_xml(name, urls, *args):
+            # the second part fails half written, as write_urlset_xml leaves it: spooled and closed
+            calls.append(name)
+            if len(calls) == 2:
+                with args[-1] as f:
+                    f.write(b"<?xml")
+                raise OSError("disk full")
+            return real(name, urls, *args)
+        with mock.patch.object(gs, "write_urlset_xml", write_urlset_xml), \
+                mock.patch.object(storage, "close") as closed, self.assertRaisesRegex(OSError, "disk full"):
+            self.build(sink)
+        self.assertEqual(os.listdir(spool), [])
+        self.assertEqual([n for n in os.listdir(storage.root) if n.endswith(".xml")], ["sitemap-00001.xml"])
+        closed.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
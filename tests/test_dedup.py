@@ -0,0 +1,124 @@
+import os, random, unittest
+from unittest import mock
+import numpy as np
+import generate_sitemaps as gs
+
+
+def corpus(n=20000, unique=6000, seed=11):
+    # Batches of varied size with duplicates inside a batch and across batches
+    rng = random.Random(seed)
+    urls = [f"https://www.leeladiamond.com/products/ring-{rng.randrange(unique)}" for _ in range(n)]
+    batches, i = [], 0
+    while i < n:
+        size = rng.choice([1, 2, 7, 64, 500, 2048])
+        batches.append(urls[i:i + size])
+        i += size
+    return batches + [[], urls[:3000]]
+
+
+def run(dedup, batches):
+    try:
+        return [dedup.new_indices(batch) for batch in batches], len(dedup)
+    finally:
+        dedup.close()
+
+
+class DedupDifferentialTest(unittest.TestCase):
+    """Every mode must return exactly what SetDedup returns, batch by batch."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.batches = corpus()
+        cls.expected = run(gs.SetDedup(), cls.batches)
+
+    def test_hash_tables(self):
+        for bits in (64, 128):
+            for capacity in (None, 1, 6000):
+                with self.subTest(bits=bits, capacity=capacity):
+                    self.assertEqual(run(gs.HashTableDedup(bits, capacity), self.batches), self.expected)
+
+    def test_forced_growth(self):
+        dedup = gs.HashTableDedup(128, 1)
+        self.assertEqual(len(dedup.table), 16)
+        self.assertEqual(run(dedup, self.batches), self.expected)
+        self.assertGreaterEqual(len(dedup.table), 6000 * 10 // 7)
+
+    def test_disk(self):
+        for max_entries in (100, 999, 1 << 20):
+            with self.subTest(max_entries=max_entries):
+                dedup = gs.make_dedup("disk", max_entries)
+                self.assertEqual(run(dedup, self.batches), self.expected)
+                self.assertFalse(os.path.exists(dedup.dir))
+
+    def test_bloom(self):
+        # At this size and error rate a false positive is vanishingly unlikely, so it behaves exactly
+        self.assertEqual(run(gs.make_dedup("bloom", 20000, 1e-9), self.batches), self.expected)
+
+    def test_make_dedup_modes(self):
+        for mode in gs.DEDUP_MODES:
+            with self.subTest(mode=mode):
+                dedup = gs.make_dedup(mode, 20000, 1e-9)
+                self.assertEqual(dedup.name, mode)
+                self.assertEqual(run(dedup, self.batches), self.expected)
+
+
+class DedupEdgeCaseTest(unittest.TestCase):
+    def test_duplicates_inside_one_batch(self):
+        batch = ["a", "b", "a", "c", "b", "a", "d", "d"]
+        for mode in gs.DEDUP_MODES:
+            with self.subTest(mode=mode):
+                dedup = gs.make_dedup(mode, 100, 1e-9)
+                self.assertEqual(dedup.new_indices(batch), [0, 1, 3, 6])
+                self.assertEqual(dedup.new_indices(batch + ["e"]), [8])
+                self.assertEqual(len(dedup), 5)
+                dedup.close()
+
+    def test_zero_key(self):
+        # Word 0 == 0 marks an empty slot, so such keys are stored as 1: a zero key is still found
+        # again, and it must not match an empty slot on its first insert
+        for words in (1, 2):
+            with self.subTest(words=words):
+                dedup = gs.HashTableDedup(64 * words, 1)
+                keys = np.array([[0, 5], [0, 5], [0, 6], [7, 5]], dtype=np.uint64)[:, :words]
+                expected = [0, 2, 3] if words == 2 else [0, 3]
+                self.assertEqual(dedup.insert(keys.copy()).tolist(), expected)
+                self.assertEqual(dedup.insert(keys.copy()).tolist(), [])
+                self.assertEqual(len(dedup), len(expected))
+                self.assertEqual(len(dedup.keys()), len(expected))
+
+    def test_zero_key_across_spills(self):
+        keys = {"zero": [0, 7], "one": [1, 8], "other": [9, 9]}
+        fake = lambda urls, words=2: np.array([keys[u] for u in urls], dtype=np.uint64)
+        with mock.patch.object(gs, "url_hashes", fake):
+            dedup = gs.make_dedup("disk", 1)
+            try:
+                self.assertEqual(dedup.new_indices(["zero"]), [0])
+                self.assertEqual(len(dedup.runs), 1)
+                self.assertEqual(dedup.new_indices(["zero", "one", "zero"]), [1])
+                self.assertEqual(dedup.new_indices(["other", "zero", "one"]), [0])
+                self.assertEqual(len(dedup), 3)
+            finally:
+                dedup.close()
+
+    def test_batches_spanning_spill_runs(self):
+        urls = [f"https://www.leeladiamond.com/products/ring-{i}" for i in range(1000)]
+        dedup = gs.make_dedup("disk", 100)
+        try:
+            for i in range(0, 1000, 37):
+                self.assertEqual(dedup.new_indices(urls[i:i + 37]), list(range(len(urls[i:i + 37]))))
+            self.assertGreaterEqual(len(dedup.runs), 9)
+            self.assertEqual(dedup.disk_bytes(), 16 * dedup.spilled)
+            # one batch touching every run, the in-memory table and new URLs
+            rng = random.Random(2)
+            mixed = rng.sample(urls, 400) + [f"https://www.leeladiamond.com/new-{i}" for i in range(50)]
+            rng.shuffle(mixed)
+            new = dedup.new_indices(mixed)
+            self.assertEqual([mixed[i] for i in new], [u for u in mixed if "/new-" in u])
+            self.assertEqual(len(dedup), 1050)
+        finally:
+            dedup.close()
+        self.assertFalse(os.path.exists(dedup.dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
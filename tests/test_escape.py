@@ -0,0 +1,46 @@
+import random, unittest
+from xml.sax.saxutils import escape
+import generate_sitemaps as gs
+from bench_sitemaps import fuzz_urls
+
+# Strings that need escaping, alone and mixed with characters escape() leaves alone
+EDGE_CASES = ["", "&", "<", ">", "&amp;", "<&>", "a&b<c>d", "\"'", "é&é", "&&", "https://www.leeladiamond.com/a?a=1&b=<2>"]
+
+
+class EscapeManyDifferentialTest(unittest.TestCase):
+    """escape_many must equal saxutils.escape string for string, whatever share of a batch needs escaping."""
+
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(3)
+        fuzzed = [u or "" for u in fuzz_urls(20000, seed=3)] + EDGE_CASES
+        clean = [u for u in fuzzed if u and "&" not in u and "<" not in u and ">" not in u]
+        cls.rng = rng
+        cls.corpora = {
+            "clean": [f"https://www.leeladiamond.com/products/ring-{i}" for i in range(20000)],
+            "rare": [u if rng.random() > 0.001 else u + "?a=1&b=<2>" for u in clean],
+            "fuzzed": fuzzed,
+            "all": [u + rng.choice("&<>") for u in clean],
+        }
+
+    def batches(self, corpus, batch=512):
+        cuts = [0]
+        while cuts[-1] < len(corpus):
+            cuts.append(cuts[-1] + self.rng.randrange(1, 2 * batch))
+        return [corpus[i:j] for i, j in zip(cuts, cuts[1:])]
+
+    def test_corpora(self):
+        for name, corpus in self.corpora.items():
+            with self.subTest(corpus=name):
+                for b in self.batches(corpus):
+                    self.assertEqual(list(gs.escape_many(b)), [escape(u) for u in b])
+
+    def test_edge_cases(self):
+        self.assertEqual(list(gs.escape_many(EDGE_CASES)), [escape(u) for u in EDGE_CASES])
+        for u in EDGE_CASES:
+            self.assertEqual(list(gs.escape_many([u])), [escape(u)])
+        self.assertEqual(list(gs.escape_many([])), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import bz2, gzip, io, os, sys, tempfile, unittest
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+import generate_sitemaps as gs
+from helpers import start_server
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FEED = "".join(f"{i},Ring {i},https://www.leeladiamond.com/products/ring-{i}\n" for i in range(20000))
+FEED = ("id,title,link\n" + FEED).encode("utf-8")
+URLS = [f"https://www.leeladiamond.com/products/ring-{i}" for i in range(20000)]
+
+CODECS = {"gzip": lambda data: gzip.compress(data, mtime=0), "bz2": bz2.compress}
+if zstandard is not None:
+    CODECS["zstd"] = lambda data: zstandard.ZstdCompressor().compress(data)
+EXTENSIONS = {kind: ext for ext, kind in gs.FEED_COMPRESSIONS.items()}
+
+
+class BlobHandler(BaseHTTPRequestHandler):
+    # Serves `payload` for any path
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.payload)))
+        self.end_headers()
+        self.wfile.write(self.server.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedCodecTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, source, **kwargs):
+        with gs.open_feed(source, **kwargs) as f:
+            return f.read()
+
+    def urls(self, source):
+        return [u for urls, _ in gs.iter_feed_batches(source, chunksize=3000) for u in urls]
+
+    def test_round_trip_by_extension(self):
+        for kind, compress in CODECS.items():
+            with self.subTest(kind=kind):
+                path = self.write("feed.csv" + EXTENSIONS[kind], compress(FEED))
+                self.assertEqual(self.read(path), FEED)
+                self.assertEqual(self.read(path, prefetch=2), FEED)
+                self.assertEqual(self.urls(path), URLS)
+
+    def test_magic_bytes_are_sniffed(self):
+        for kind, compress in CODECS.items():
+            with self.subTest(kind=kind):
+                path = self.write("feed.csv", compress(FEED))
+                with open(path, "rb") as raw:
+                    self.assertEqual(gs.feed_compression(path, raw), kind)
+                self.assertEqual(self.read(path), FEED)
+                # an already-open stream with no name to go by
+                self.assertEqual(self.read(io.BufferedReader(io.BytesIO(compress(FEED)))), FEED)
+
+    def test_sniffing_needs_the_whole_bz2_signature(self):
+        for head in (b"BZh9", b"BZh91AY&SX", b"\x1f", b"\x28\xb5\x2f"):
+            with self.subTest(head=head):
+                self.assertIsNone(gs.feed_compression("feed", io.BufferedReader(io.BytesIO(head + b"," * 20))))
+        self.assertEqual(gs.feed_compression("feed", io.BufferedReader(io.BytesIO(bz2.compress(b"x")))), "bz2")
+        # without peek() there is nothing to sniff
+        self.assertIsNone(gs.feed_compression("feed", io.BytesIO(gzip.compress(FEED))))
+
+    def test_plain_feed_is_passed_through(self):
+        path = self.write("feed.csv", FEED)
+        with gs.open_feed(path) as f:
+            self.assertIsInstance(f, io.BufferedReader)
+            self.assertNotIsInstance(f.raw, gs.DecompressingReader)
+            self.assertEqual(f.read(), FEED)
+        stream = io.BufferedReader(io.BytesIO(FEED))
+        self.assertIs(gs.open_feed(stream), stream)
+        self.assertEqual(self.urls(path), URLS)
+
+    def test_remote_feed_is_sniffed(self):
+        server = start_server(BlobHandler, self, payload=gzip.compress(FEED, mtime=0))
+        # the URL's extension says nothing, the magic bytes do
+        url = f"http://127.0.0.1:{server.server_port}/export?format=csv"
+        self.assertEqual(self.read(url), FEED)
+        self.assertEqual(self.urls(url), URLS)
+
+    def test_close_closes_the_source(self):
+        for kind, compress in CODECS.items():
+            with self.subTest(kind=kind):
+                source = io.BufferedReader(io.BytesIO(compress(FEED)))
+                f = gs.open_feed(source)
+                self.assertEqual(f.read(100), FEED[:100])
+                f.close()
+                self.assertTrue(source.closed)
+
+    def test_truncated_feed_raises(self):
+        path = self.write("feed.csv.gz", gzip.compress(FEED)[:-100])
+        with self.assertRaises(EOFError):
+            self.read(path)
+
+    def test_zstd_without_zstandard(self):
+        path = self.write("feed.csv.zst", b"\x28\xb5\x2f\xfd" + b"\0" * 16)
+        with mock.patch.dict(sys.modules, {"zstandard": None}), open(path, "rb") as source:
+            with self.assertRaisesRegex(RuntimeError, "requires the zstandard package"):
+                gs.open_feed(source)
+            self.assertTrue(source.closed)
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd_frames_without_content_size(self):
+        # streamed zstd output (no frame content size in the header) still decodes
+        out = io.BytesIO()
+        with zstandard.ZstdCompressor().stream_writer(out, closefd=False) as w:
+            w.write(FEED)
+        self.assertEqual(self.read(self.write("feed.csv.zst", out.getvalue())), FEED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import hashlib, os, tempfile, unittest
+from http.server import BaseHTTPRequestHandler
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main, start_server
+
+FEED = "".join(f"{i},Ring {i},https://www.leeladiamond.com/products/ring-{i}\n" for i in range(5000))
+FEED = ("id,title,link\n" + FEED).encode("utf-8")
+ETAG = '"v1"'
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    # Serves FEED with an ETag and answers a matching If-None-Match with 304; records each request
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(FEED)))
+        self.end_headers()
+        self.wfile.write(FEED)
+
+    def log_message(self, *args):
+        pass
+
+
+class FetchFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.server = start_server(FeedHandler, self, requests=[])
+        self.url = f"http://127.0.0.1:{self.server.server_port}/feeds/products.csv"
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = os.path.join(self.tmp.name, "cache")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_200_downloads_and_hashes(self):
+        path, sha256, downloaded = gs.fetch_feed(self.url, self.cache)
+        self.assertTrue(downloaded)
+        self.assertEqual(path, os.path.join(self.cache, "products.csv"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), FEED)
+        self.assertEqual(sha256, hashlib.sha256(FEED).hexdigest())
+        self.assertEqual(gs.load_feed_meta(self.cache)["etag"], ETAG)
+
+    def test_304_reuses_cache(self):
+        first = gs.fetch_feed(self.url, self.cache)
+        path, sha256, downloaded = gs.fetch_feed(self.url, self.cache)
+        self.assertFalse(downloaded)
+        self.assertEqual((path, sha256), first[:2])
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), ETAG)
+
+    def test_stream_saves_while_reading(self):
+        stream, sha256, downloaded = gs.fetch_feed(self.url, self.cache, stream=True)
+        self.assertIsNone(sha256)
+        self.assertTrue(downloaded)
+        with stream:
+            self.assertEqual(stream.read(), FEED)
+        self.assertEqual(stream.raw.sha256, hashlib.sha256(FEED).hexdigest())
+        self.assertEqual(gs.load_feed_meta(self.cache)["sha256"], stream.raw.sha256)
+        path, _, downloaded = gs.fetch_feed(self.url, self.cache)
+        self.assertFalse(downloaded)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), FEED)
+
+    def run_main(self, outdir):
+        return run_main("--csv", self.url, "--feed-cache", self.cache, "--outdir", outdir,
+                        "--public-base-url", BASE_URL)
+
+    def test_unchanged_feed_skips_build(self):
+        outdir = os.path.join(self.tmp.name, "out")
+        first = self.run_main(outdir)
+        self.assertIn("parsing it while it downloads", first)
+        index = os.path.join(outdir, "sitemap-index.xml")
+        with open(os.path.join(outdir, "sitemap-00001.xml"), encoding="utf-8") as f:
+            self.assertEqual(f.read().count("<loc>"), 5000)
+        mtime = os.stat(index).st_mtime_ns
+        second = self.run_main(outdir)
+        self.assertIn("not modified, using cached copy", second)
+        self.assertIn("Feed unchanged since the last successful build", second)
+        self.assertEqual(os.stat(index).st_mtime_ns, mtime)
+        self.assertEqual(len(self.server.requests), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
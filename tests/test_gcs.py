@@ -0,0 +1,109 @@
+import base64, gzip, hashlib, json, os, tempfile, unittest
+from unittest import mock
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main, start_gcs_server
+
+
+def md5_b64(data):
+    return base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+
+
+class GCSStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.endpoint = start_gcs_server(self, "/gcs")
+        self.sleeps = []
+        patcher = mock.patch.object(gs.time, "sleep", self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def storage(self, prefix="sitemaps"):
+        storage = gs.GCSStorage("sitemaps.leeladiamond.com", prefix, self.endpoint, token="secret")
+        self.addCleanup(storage.close)
+        return storage
+
+    def put(self, storage, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        storage.put(name, path, gs.object_headers(name, "public, max-age=60"), {"md5": md5_b64(data)})
+
+    def test_multipart_upload(self):
+        storage = self.storage()
+        xml = b'<?xml version="1.0" encoding="UTF-8"?>\n<urlset/>\n'
+        packed = gzip.compress(xml, mtime=0)
+        self.put(storage, "sitemap-00001.xml", xml)
+        self.put(storage, "sitemap-00002.xml.gz", packed)
+        self.assertEqual({r["path"] for r in self.server.requests},
+                         {"/gcs/upload/storage/v1/b/sitemaps.leeladiamond.com/o?uploadType=multipart"})
+        self.assertEqual({r["auth"] for r in self.server.requests}, {"Bearer secret"})
+        self.assertTrue(all(r["content_type"].startswith("multipart/related; boundary=")
+                            for r in self.server.requests))
+        plain = self.server.objects["sitemaps/sitemap-00001.xml"]
+        self.assertEqual(plain["media"], xml)
+        self.assertEqual(plain["media_type"], "application/xml; charset=utf-8")
+        self.assertEqual(plain["meta"], {"name": "sitemaps/sitemap-00001.xml",
+                                         "contentType": "application/xml; charset=utf-8",
+                                         "cacheControl": "public, max-age=60", "md5Hash": md5_b64(xml)})
+        # gzip parts are stored compressed and served with Content-Encoding: gzip
+        packed_obj = self.server.objects["sitemaps/sitemap-00002.xml.gz"]
+        self.assertEqual(packed_obj["media"], packed)
+        self.assertEqual(packed_obj["meta"]["contentEncoding"], "gzip")
+        self.assertEqual(packed_obj["meta"]["md5Hash"], md5_b64(packed))
+        # one keep-alive connection for both uploads
+        self.assertEqual(len(storage.connections), 1)
+
+    def test_delete_encodes_the_object_name(self):
+        storage = self.storage("site maps/v1")
+        self.put(storage, "a+b.xml", b"<urlset/>")
+        storage.delete("a+b.xml")
+        storage.delete("a+b.xml")  # already gone: 404 is not an error
+        self.assertEqual([r["path"] for r in self.server.requests if r["method"] == "DELETE"],
+                         ["/gcs/storage/v1/b/sitemaps.leeladiamond.com/o/site%20maps%2Fv1%2Fa%2Bb.xml"] * 2)
+        self.assertEqual(self.server.objects, {})
+
+    def test_retries_5xx(self):
+        storage = self.storage()
+        self.server.script = [503, 500]
+        self.put(storage, "sitemap-00001.xml", b"<urlset/>")
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.sleeps, [1, 2])
+        self.assertIn("sitemaps/sitemap-00001.xml", self.server.objects)
+        self.server.script = [502, 502, 502]
+        with self.assertRaisesRegex(RuntimeError, "GCS DELETE .* failed: 502"):
+            storage.delete("sitemap-00001.xml")
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertIn("sitemaps/sitemap-00001.xml", self.server.objects)
+
+    def test_client_error_is_not_retried(self):
+        self.server.script = [403]
+        with self.assertRaisesRegex(RuntimeError, "failed: 403"):
+            self.put(self.storage(), "sitemap-00001.xml", b"<urlset/>")
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_upload_cli(self):
+        csv_path = os.path.join(self.tmp.name, "feed.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("id,link\n" + "".join(f"{i},https://www.leeladiamond.com/products/ring-{i}\n" for i in range(250)))
+        outdir = os.path.join(self.tmp.name, "out")
+        args = ("--csv", csv_path, "--outdir", outdir, "--public-base-url", BASE_URL, "--per-file", "100",
+                "--compress", "gzip", "--upload", "gs://sitemaps.leeladiamond.com/sitemaps",
+                "--upload-endpoint", self.endpoint)
+        with mock.patch.dict(os.environ, {"GCS_OAUTH_TOKEN": "from-env"}):
+            self.assertIn("upload: 4 changed objects uploaded, 0 deleted", run_main(*args))
+            for name in os.listdir(outdir):
+                with open(os.path.join(outdir, name), "rb") as f:
+                    data = f.read()
+                obj = self.server.objects[f"sitemaps/{name}"]
+                self.assertEqual((obj["media"], obj["meta"]["md5Hash"]), (data, md5_b64(data)))
+            self.assertEqual({r["auth"] for r in self.server.requests}, {"Bearer from-env"})
+            # nothing changed: nothing is sent
+            sent = len(self.server.requests)
+            self.assertIn("upload: 0 changed objects uploaded, 0 deleted", run_main(*args))
+            self.assertEqual(len(self.server.requests), sent)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import gzip, os, re, tempfile, unittest
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main
+
+
+def url(i):
+    return f"https://www.leeladiamond.com/products/ring-{i:04d}"
+
+
+class IncrementalBuildTest(unittest.TestCase):
+    # 350 URLs at --per-file 100: parts 1-3 full, part 4 holding 50
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.outdir = os.path.join(self.tmp.name, "out")
+        self.build(range(350))
+
+    def build(self, ids, *args):
+        csv_path = os.path.join(self.tmp.name, "feed.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("id,link\n" + "".join(f"{i},{url(i)}\n" for i in ids))
+        out = run_main("--csv", csv_path, "--outdir", self.outdir, "--public-base-url", BASE_URL,
+                       "--per-file", "100", "--incremental", *args)
+        rewritten, total = map(int, re.search(r"incremental: rewrote (\d+) of (\d+) part files", out).groups())
+        return rewritten, total, out
+
+    def part(self, number):
+        with open(os.path.join(self.outdir, f"sitemap-{number:05d}.xml"), encoding="utf-8") as f:
+            return re.findall(r"<loc>(.*?)</loc>", f.read())
+
+    def snapshot(self):
+        return {n: os.stat(os.path.join(self.outdir, n)).st_mtime_ns
+                for n in os.listdir(self.outdir) if n.startswith("sitemap-0")}
+
+    def index(self):
+        with open(os.path.join(self.outdir, "sitemap-index.xml"), encoding="utf-8") as f:
+            return [loc.rsplit("/", 1)[1] for loc in re.findall(r"<loc>(.*?)</loc>", f.read())]
+
+    def test_unchanged_feed_rewrites_nothing(self):
+        before = self.snapshot()
+        self.assertEqual(self.build(range(350))[:2], (0, 4))
+        # the same URLs in another order are still the same parts
+        self.assertEqual(self.build(reversed(range(350)))[:2], (0, 4))
+        self.assertEqual(self.snapshot(), before)
+
+    def test_appended_urls_rewrite_only_the_tail(self):
+        before = self.snapshot()
+        self.assertEqual(self.build(range(380))[:2], (1, 4))
+        after = self.snapshot()
+        self.assertEqual([n for n in after if after[n] != before[n]], ["sitemap-00004.xml"])
+        self.assertEqual(self.part(4), [url(i) for i in range(300, 380)])
+        # past the tail's room, new parts follow
+        self.assertEqual(self.build(range(520))[:2], (3, 6))
+        self.assertEqual(self.part(5), [url(i) for i in range(400, 500)])
+
+    def test_removed_urls_free_their_slots(self):
+        ids = [i for i in range(350) if not 120 <= i < 130] + list(range(1000, 1015))
+        self.assertEqual(self.build(ids)[:2], (2, 4))
+        # part 2 takes back 10 new URLs, the other 5 go to the tail part
+        self.assertEqual(self.part(2), [url(i) for i in range(100, 200) if not 120 <= i < 130]
+                         + [url(i) for i in range(1000, 1010)])
+        self.assertEqual(self.part(4), [url(i) for i in range(300, 350)] + [url(i) for i in range(1010, 1015)])
+        self.assertEqual(self.part(1), [url(i) for i in range(100)])
+
+    def test_emptied_part_is_deleted(self):
+        rewritten, total, _ = self.build([i for i in range(350) if not 200 <= i < 300])
+        self.assertEqual((rewritten, total), (0, 3))
+        self.assertFalse(os.path.exists(os.path.join(self.outdir, "sitemap-00003.xml")))
+        self.assertEqual(self.index(), ["sitemap-00001.xml", "sitemap-00002.xml", "sitemap-00004.xml"])
+        manifest = gs.load_manifest(self.outdir)
+        self.assertEqual([p["name"] for p in manifest["parts"]], self.index())
+        # its number is not reused: new URLs fill part 4, then part 5
+        self.build([i for i in range(350) if not 200 <= i < 300] + list(range(1000, 1060)))
+        self.assertEqual(self.index(), ["sitemap-00001.xml", "sitemap-00002.xml", "sitemap-00004.xml",
+                                        "sitemap-00005.xml"])
+
+    def test_manifest_alone_is_enough(self):
+        # only the state files restored, as in the nightly workflow
+        for name in self.snapshot():
+            os.remove(os.path.join(self.outdir, name))
+        self.assertEqual(self.build(range(355))[:2], (1, 4))
+        self.assertEqual(sorted(self.snapshot()), ["sitemap-00004.xml"])
+        self.assertEqual(self.index(), [f"sitemap-{i:05d}.xml" for i in range(1, 5)])
+
+    def test_changed_settings_rebuild_everything(self):
+        self.assertEqual(self.build(range(350), "--max-bytes", "40000")[:2], (4, 4))
+        self.assertEqual(self.build(range(350), "--per-file", "120")[:2], (3, 3))
+        self.assertEqual(self.build(range(350), "--per-file", "120")[:2], (0, 3))
+
+    def test_corrupt_manifest_rebuilds_everything(self):
+        path = os.path.join(self.outdir, gs.MANIFEST_NAME)
+        for data in (b"not gzip", gzip.compress(b"{not json"), gzip.compress(b'{"version": 1, "parts": [{}]}'),
+                     gzip.compress(b"[]")):
+            with open(path, "wb") as f:
+                f.write(data)
+            rewritten, total, out = self.build(range(350))
+            self.assertEqual((rewritten, total), (4, 4))
+            self.assertIn("ignoring unreadable", out)
+        self.assertEqual(self.build(range(350))[:2], (0, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import datetime, os, re, tempfile, unittest
+from array import array
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main
+
+TODAY = datetime.datetime.now(datetime.UTC).date()
+
+
+def url(i):
+    return f"https://www.leeladiamond.com/products/ring-{i}"
+
+
+def read_state(path):
+    with open(path, "rb") as f:
+        n = int.from_bytes(f.read(8), "little")
+        keys, values = array("Q"), array("Q")
+        keys.fromfile(f, n)
+        values.fromfile(f, n)
+    return keys, values
+
+
+def write_state(path, keys, values):
+    with open(path, "wb") as f:
+        f.write(len(keys).to_bytes(8, "little"))
+        array("Q", keys).tofile(f)
+        array("Q", values).tofile(f)
+
+
+def backdate(path, days):
+    keys, values = read_state(path)
+    write_state(path, keys, [v - days for v in values])
+
+
+def entries(outdir):
+    # url -> lastmod over every part file
+    found = {}
+    for name in sorted(os.listdir(outdir)):
+        if re.fullmatch(r"sitemap-\d+\.xml", name):
+            with open(os.path.join(outdir, name), encoding="utf-8") as f:
+                found.update(re.findall(r"<loc>(.*?)</loc>\s*<lastmod>(.*?)</lastmod>", f.read()))
+    return found
+
+
+class ContentLastmodsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, gs.LASTMOD_STATE_NAME)
+
+    def run_batches(self, rows, batch=3):
+        # rows: (url, price); returns (lastmods, state)
+        state = gs.ContentLastmods(self.path)
+        lastmods = []
+        for i in range(0, len(rows), batch):
+            chunk = rows[i:i + batch]
+            lastmods += state.lastmods([u for u, _ in chunk], [[p for _, p in chunk], ["in stock"] * len(chunk)])
+        state.save()
+        return lastmods, state
+
+    def test_first_run_is_today(self):
+        lastmods, state = self.run_batches([(url(i), "10") for i in range(7)])
+        self.assertEqual(lastmods, [TODAY.isoformat()] * 7)
+        self.assertEqual((state.changed, len(state)), (7, 7))
+
+    def test_unchanged_hash_keeps_previous_lastmod(self):
+        self.run_batches([(url(i), "10") for i in range(7)])
+        backdate(self.path, 30)
+        earlier = (TODAY - datetime.timedelta(days=30)).isoformat()
+        # ring-2 changes price, ring-5 leaves the feed, ring-9 is new
+        rows = [(url(i), "11" if i == 2 else "10") for i in (0, 1, 2, 3, 4, 6, 9)]
+        lastmods, state = self.run_batches(rows)
+        today = TODAY.isoformat()
+        self.assertEqual(lastmods, [earlier, earlier, today, earlier, earlier, earlier, today])
+        self.assertEqual((state.changed, len(state)), (2, 7))
+        # the kept dates survive another run unchanged; ring-5 was dropped from the state
+        lastmods, state = self.run_batches(rows + [(url(5), "10")])
+        self.assertEqual(lastmods[:-1], [earlier, earlier, today, earlier, earlier, earlier, today])
+        self.assertEqual(lastmods[-1], today)
+        self.assertEqual(state.changed, 1)
+
+    def test_saved_state_is_sorted_and_reads_unsorted(self):
+        self.run_batches([(url(i), "10") for i in range(50)], batch=7)
+        keys, values = read_state(self.path)
+        self.assertEqual(list(keys), sorted(keys))
+        self.assertEqual(sorted(keys), sorted(gs.url_hash64(url(i)) for i in range(50)))
+        # state files written in feed order (before the keys were sorted) still match
+        write_state(self.path, [k for k in reversed(keys)], [v - 3 for v in reversed(values)])
+        lastmods, state = self.run_batches([(url(i), "10") for i in range(50)], batch=7)
+        self.assertEqual(set(lastmods), {(TODAY - datetime.timedelta(days=3)).isoformat()})
+        self.assertEqual(state.changed, 0)
+
+
+class LastmodColumnsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.outdir = os.path.join(self.tmp.name, "out")
+
+    def build(self, rows, *args):
+        csv_path = os.path.join(self.tmp.name, "feed.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("id,link,updated,price\n" + "".join(",".join(map(str, row)) + "\n" for row in rows))
+        return run_main("--csv", csv_path, "--outdir", self.outdir, "--public-base-url", BASE_URL, *args)
+
+    def test_lastmod_column(self):
+        self.build([(1, url(1), "2024-05-01", 10), (2, url(2), "2024-05-01T10:30:00+02:00", 10),
+                    (3, url(3), "yesterday", 10), (4, url(4), "", 10), (5, url(1), "2020-01-01", 10)],
+                   "--lastmod-column", "updated")
+        self.assertEqual(entries(self.outdir), {url(1): "2024-05-01", url(2): "2024-05-01T10:30:00+02:00",
+                                                url(3): TODAY.isoformat(), url(4): TODAY.isoformat()})
+
+    def test_hash_columns_across_runs(self):
+        args = ("--lastmod-column", "updated", "--lastmod-hash-columns", "price")
+        rows = [(i, url(i), "", 10) for i in range(1, 6)]
+        self.assertIn("lastmod: 5 of 5 URLs new or changed", self.build(rows, *args))
+        backdate(os.path.join(self.outdir, gs.LASTMOD_STATE_NAME), 10)
+        earlier = (TODAY - datetime.timedelta(days=10)).isoformat()
+        # ring-2's price changes; ring-3 has an explicit lastmod, which wins over the derived one
+        rows[1] = (2, url(2), "", 11)
+        rows[2] = (3, url(3), "2024-05-01", 10)
+        self.assertIn("lastmod: 1 of 5 URLs new or changed", self.build(rows, *args))
+        self.assertEqual(entries(self.outdir), {url(1): earlier, url(2): TODAY.isoformat(), url(3): "2024-05-01",
+                                                url(4): earlier, url(5): earlier})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import contextlib, io, os, re, tempfile, unittest
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main
+
+TODAY = "2024-01-01"
+LOW = len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + gs.url_entry_bytes("/", TODAY)
+
+
+def url(i, width=4):
+    return f"https://www.leeladiamond.com/products/ring-{i:0{width}d}"
+
+
+class EntrySizeTest(unittest.TestCase):
+    def test_url_entry_bytes_matches_the_written_entry(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, "part.xml")
+        for u in (url(1), "https://www.leeladiamond.com/a?b=1&c=<2>", "https://www.leeladiamond.com/bagues/élan"):
+            with self.subTest(url=u):
+                size = gs.write_urlset_xml(path, [u], lastmods=[TODAY])
+                self.assertEqual(size, os.path.getsize(path))
+                self.assertEqual(size - len(gs.URLSET_HEADER) - len(gs.URLSET_FOOTER), gs.url_entry_bytes(u, TODAY))
+
+    def test_part_budget_bounds(self):
+        self.assertEqual(gs.part_budget(LOW), gs.url_entry_bytes("/", TODAY))
+        self.assertEqual(gs.part_budget(gs.MAX_SITEMAP_BYTES),
+                         gs.MAX_SITEMAP_BYTES - len(gs.URLSET_HEADER) - len(gs.URLSET_FOOTER))
+        for bad in (LOW - 1, gs.MAX_SITEMAP_BYTES + 1):
+            with self.assertRaisesRegex(ValueError, "max_bytes must be between"):
+                gs.part_budget(bad)
+
+    def test_check_entry_size(self):
+        gs.check_entry_size(url(1), 100, 100)
+        with self.assertRaisesRegex(ValueError, r"entry of 101 bytes exceeds the 100 bytes .*ring-0001"):
+            gs.check_entry_size(url(1), 101, 100)
+
+
+class PartAccumulatorTest(unittest.TestCase):
+    def fill(self, acc, urls):
+        parts = [done[0] for u in urls if (done := acc.push(u, None, gs.url_entry_bytes(u, TODAY)))]
+        return parts + ([acc.take()[0]] if acc.items else [])
+
+    def test_rolls_over_at_the_exact_byte_limit(self):
+        entry = gs.url_entry_bytes(url(0), TODAY)
+        urls = [url(i) for i in range(7)]
+        # three entries fill the part to the byte: the fourth starts the next one
+        exact = len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + 3 * entry
+        self.assertEqual(self.fill(gs.PartAccumulator(100, exact), urls), [urls[:3], urls[3:6], urls[6:]])
+        # one byte less and only two fit
+        self.assertEqual(self.fill(gs.PartAccumulator(100, exact - 1), urls),
+                         [urls[:2], urls[2:4], urls[4:6], urls[6:]])
+
+    def test_per_file_or_max_bytes_whichever_first(self):
+        urls = [url(i) for i in range(10)]
+        self.assertEqual(self.fill(gs.PartAccumulator(4), urls), [urls[:4], urls[4:8], urls[8:]])
+        entry = gs.url_entry_bytes(url(0), TODAY)
+        acc = gs.PartAccumulator(4, len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + 3 * entry)
+        self.assertEqual(self.fill(acc, urls), [urls[:3], urls[3:6], urls[6:9], urls[9:]])
+
+    def test_oversized_entry_is_rejected(self):
+        entry = gs.url_entry_bytes(url(0), TODAY)
+        acc = gs.PartAccumulator(100, len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + entry)
+        # an entry of exactly the budget fits a part on its own
+        self.assertIsNone(acc.push(url(0), None, entry))
+        with self.assertRaisesRegex(ValueError, "exceeds"):
+            acc.push(url(10, 5), None, entry + 1)
+        self.assertEqual(acc.items, [url(0)])
+
+
+class MaxBytesBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.outdir = os.path.join(self.tmp.name, "out")
+
+    def build(self, urls, *args):
+        csv_path = os.path.join(self.tmp.name, "feed.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write("id,link\n" + "".join(f"{i},{u}\n" for i, u in enumerate(urls)))
+        return run_main("--csv", csv_path, "--outdir", self.outdir, "--public-base-url", BASE_URL, *args)
+
+    def parts(self):
+        names = sorted(n for n in os.listdir(self.outdir) if re.fullmatch(r"sitemap-\d+\.xml", n))
+        return {n: os.path.getsize(os.path.join(self.outdir, n)) for n in names}
+
+    def test_rollover(self):
+        urls = [url(i) for i in range(250)]
+        # equal-length URLs: exactly 40 entries per part
+        limit = len(gs.URLSET_HEADER) + len(gs.URLSET_FOOTER) + 40 * gs.url_entry_bytes(urls[0], TODAY)
+        for extra in ((), ("--incremental",)):
+            with self.subTest(extra=extra):
+                self.build(urls, "--max-bytes", str(limit), *extra)
+                sizes = list(self.parts().values())
+                self.assertEqual(len(sizes), 7)
+                self.assertEqual(sizes[:6], [limit] * 6)
+                self.assertLess(sizes[6], limit)
+
+    def test_oversized_entry_fails_the_build(self):
+        limit = LOW + 100  # room for url(1) but not the 229-character URL
+        with self.assertRaisesRegex(ValueError, "exceeds .*/xxxx"):
+            self.build([url(1), "https://www.leeladiamond.com/" + "x" * 200], "--max-bytes", str(limit))
+
+    def test_out_of_range_max_bytes_is_a_usage_error(self):
+        err = io.StringIO()
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(err):
+            self.build([url(1)], "--max-bytes", str(LOW - 1))
+        self.assertIn("argument --max-bytes: max_bytes must be between", err.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import generate_sitemaps as gs
+from bench_sitemaps import fuzz_urls, reference_normalize
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Near misses of the canonical shape that must not be returned as is
+EDGE_CASES = [
+    None, "", " ", "#", "?",
+    "https://www.leeladiamond.com", "https://www.leeladiamond.com/", "https://www.leeladiamond.com?",
+    "https://www.leeladiamond.com/a?", "https://www.leeladiamond.com/a?#x", "https://www.leeladiamond.com/a#x",
+    "https://www.leeladiamond.com/a\n", " https://www.leeladiamond.com/a", "https://www.leeladiamond.com/a b",
+    "https://www.leeladiamond.com/a;p=1?q=2", "https://www.leeladiamond.com/é", "https://www.leeladiamond.com:443/a",
+    "https://www.leeladiamond.comx/a", "https://www.leeladiamond.com.evil.com/a", "https://www.leeladiamond.com\\a",
+    "HTTPS://www.leeladiamond.com/a", "http://www.leeladiamond.com/a?a=1&b=<2>", "https://shop.leeladiamond.com/a",
+]
+
+
+class NormalizeDifferentialTest(unittest.TestCase):
+    """normalize_url's fast paths and every normalize_urls container must equal urlparse normalization."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.corpus = EDGE_CASES + fuzz_urls(20000, seed=7)
+        cls.expected = [reference_normalize(u) for u in cls.corpus]
+
+    def test_normalize_url(self):
+        self.assertEqual([gs.normalize_url(u) for u in self.corpus], self.expected)
+
+    def test_list_and_tuple(self):
+        self.assertEqual(gs.normalize_urls(self.corpus), self.expected)
+        self.assertEqual(gs.normalize_urls(tuple(self.corpus)), self.expected)
+
+    @unittest.skipIf(pd is None, "pandas not installed")
+    def test_pandas(self):
+        out = gs.normalize_urls(pd.Series(self.corpus, dtype=object))
+        self.assertEqual(out.tolist(), self.expected)
+
+    @unittest.skipIf(pa is None, "pyarrow not installed")
+    def test_arrow(self):
+        self.assertEqual(gs.normalize_urls(pa.array(self.corpus, type=pa.string())).to_pylist(), self.expected)
+        half = len(self.corpus) // 2
+        chunked = pa.chunked_array([self.corpus[:half], self.corpus[half:]], type=pa.string())
+        self.assertEqual(gs.normalize_urls(chunked).to_pylist(), self.expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
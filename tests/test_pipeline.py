@@ -0,0 +1,86 @@
+import os, tempfile, time, unittest
+from unittest import mock
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main, start_purge_server
+
+
+def feed(n):
+    return "id,link\n" + "".join(f"{i},https://www.leeladiamond.com/products/ring-{i}\n" for i in range(n))
+
+
+class RecordingStorage(gs.LocalStorage):
+    # LocalStorage that logs each put/delete as it completes. Part uploads are slowed down so they
+    # are still in flight when the index is written, as with a real bucket
+    def __init__(self, root, events):
+        super().__init__(root)
+        self.events = events
+
+    def put(self, name, path, headers, digests):
+        if name != "sitemap-index.xml":
+            time.sleep(0.05)
+        super().put(name, path, headers, digests)
+        self.events.append(("put", name))
+
+    def delete(self, name):
+        super().delete(name)
+        self.events.append(("delete", name))
+
+
+class RunPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.server, self.endpoint = start_purge_server(self, self.events)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.remote = os.path.join(self.tmp.name, "remote")
+        storage = RecordingStorage(self.remote, self.events)
+        for patcher in (mock.patch.object(gs, "open_storage", lambda dest, endpoint=None: storage),
+                        mock.patch.dict(os.environ, {"CF_ZONE_ID": "zone1", "CF_API_TOKEN": "secret"})):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_pipeline(self, rows):
+        csv_path = os.path.join(self.tmp.name, "feed.csv")
+        with open(csv_path, "w", encoding="utf-8") as f:
+            f.write(feed(rows))
+        # A fresh outdir per run, as in the workflow; the upload manifest lives next to it
+        outdir = tempfile.mkdtemp(dir=self.tmp.name)
+        del self.events[:]
+        run_main("--csv", csv_path, "--outdir", outdir, "--public-base-url", BASE_URL, "--per-file", "1000",
+                 "--pipeline", "--upload", self.remote, "--purge", "--purge-endpoint", self.endpoint)
+        return list(self.events)
+
+    def assert_order(self, events, parts):
+        index = events.index(("put", "sitemap-index.xml"))
+        puts = [i for i, (kind, name) in enumerate(events) if kind == "put" and name in parts]
+        self.assertTrue(puts and max(puts) < index, "a part was uploaded after the index")
+        purges = [i for i, (kind, _) in enumerate(events) if kind == "purge"]
+        self.assertTrue(purges and min(purges) > index, "the purge started before the index was up")
+        return index, purges
+
+    def test_parts_before_index_and_purge_after(self):
+        events = self.run_pipeline(3500)
+        parts = {f"sitemap-{i:05d}.xml" for i in range(1, 5)}
+        self.assert_order(events, parts)
+        self.assertTrue(parts <= set(os.listdir(self.remote)))
+        self.assertEqual({name for kind, name in events if kind == "purge"}, parts | {"sitemap-index.xml", ""})
+
+    def test_stale_objects_deleted(self):
+        self.run_pipeline(3500)
+        events = self.run_pipeline(1500)
+        index, purges = self.assert_order(events, {"sitemap-00002.xml"})
+        stale = {"sitemap-00003.xml", "sitemap-00004.xml"}
+        deletes = [i for i, (kind, name) in enumerate(events) if kind == "delete"]
+        self.assertEqual({events[i][1] for i in deletes}, stale)
+        self.assertTrue(index < min(deletes) and max(deletes) < min(purges))
+        self.assertFalse(stale & set(os.listdir(self.remote)))
+        # unchanged part 1 is neither uploaded nor purged; the deleted parts are purged
+        self.assertNotIn(("put", "sitemap-00001.xml"), events)
+        self.assertEqual({name for kind, name in events if kind == "purge"},
+                         stale | {"sitemap-00002.xml", "sitemap-index.xml", ""})
+
+
+if __name__ == "__main__":
+    unittest.main()
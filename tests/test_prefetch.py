@@ -0,0 +1,85 @@
+import io, threading, unittest
+import generate_sitemaps as gs
+
+BLOCK = 1 << 10
+
+
+class FakeRaw(io.RawIOBase):
+    # `blocks` blocks of BLOCK bytes (forever if None), then EOF or, with `fail`, that exception
+    def __init__(self, blocks=None, fail=None):
+        super().__init__()
+        self.blocks, self.fail, self.served = blocks, fail, 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.blocks is not None and self.served >= self.blocks:
+            if self.fail is not None:
+                raise self.fail
+            return 0
+        n = min(len(b), BLOCK)
+        b[:n] = bytes([self.served % 251]) * n
+        self.served += 1
+        return n
+
+
+def prefetch(raw, depth=2):
+    return gs.PrefetchReader(raw, block_size=BLOCK, depth=depth)
+
+
+class PrefetchReaderTest(unittest.TestCase):
+    def test_reads_everything_in_order(self):
+        reader = prefetch(FakeRaw(50))
+        data = io.BufferedReader(reader, 3000).read()
+        self.assertEqual(data, b"".join(bytes([i]) * BLOCK for i in range(50)))
+        self.assertEqual(reader.stats["bytes"], 50 * BLOCK)
+        self.assertEqual(reader.read(10), b"")
+        reader.close()
+
+    def test_producer_exception_reaches_the_reader(self):
+        reader = prefetch(FakeRaw(5, fail=ConnectionResetError("peer reset")))
+        # the blocks read before the failure are delivered first
+        received = b""
+        with self.assertRaisesRegex(ConnectionResetError, "peer reset"):
+            while chunk := reader.read(BLOCK):
+                received += chunk
+        self.assertEqual(len(received), 5 * BLOCK)
+        # a later read fails the same way instead of waiting on a producer that has stopped
+        outcome = []
+        def read_again():
+            try:
+                reader.read(BLOCK)
+            except ConnectionResetError as e:
+                outcome.append(e)
+        again = threading.Thread(target=read_again, daemon=True)
+        again.start()
+        again.join(10)
+        self.assertFalse(again.is_alive(), "read() after the failure hung")
+        self.assertEqual([str(e) for e in outcome], ["peer reset"])
+        reader.close()
+        self.assertTrue(reader.raw.closed)
+
+    def test_close_when_the_consumer_stops_early(self):
+        raw = FakeRaw()  # endless: the producer keeps the queue full
+        reader = prefetch(raw)
+        self.assertEqual(reader.read(100), bytes(100))
+        closer = threading.Thread(target=reader.close)
+        closer.start()
+        closer.join(10)
+        self.assertFalse(closer.is_alive(), "close() hung on a blocked producer")
+        self.assertFalse(reader.thread.is_alive())
+        self.assertTrue(raw.closed and reader.closed)
+        reader.close()  # idempotent
+
+    def test_early_exit_through_open_feed(self):
+        # a parser abandoning the feed part-way, as on a bad header or a sharded run stopping early
+        raw = io.BufferedReader(FakeRaw(10_000))
+        with gs.open_feed(raw, prefetch=2) as f:
+            self.assertEqual(len(f.read(5 * BLOCK)), 5 * BLOCK)
+        self.assertTrue(raw.closed)
+        self.assertLess(raw.raw.served, 10_000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import collections, os, pstats, tempfile, unittest
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main
+
+FEED = "id,link\n" + "".join(f"{i},https://www.leeladiamond.com/products/ring-{i % 3000}\n" for i in range(20000))
+
+
+def collapsed_total(path):
+    with open(path, encoding="utf-8") as f:
+        return sum(int(line.rsplit(" ", 1)[1]) for line in f)
+
+
+class CProfileSessionTest(unittest.TestCase):
+    def profile(self, fn):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "feed.csv")
+            with open(csv_path, "w", encoding="utf-8") as f:
+                f.write(FEED)
+            session = gs._PROFILER = gs.CProfileSession()
+            session.start()
+            try:
+                fn(csv_path)
+            finally:
+                gs._PROFILER = None
+            pstats_path, collapsed_path = session.stop(os.path.join(tmp, "profile"))
+            with open(collapsed_path, encoding="utf-8") as f:
+                stacks = [line.rsplit(" ", 1)[0] for line in f]
+            return pstats.Stats(pstats_path).total_tt, collapsed_total(collapsed_path), stacks
+
+    def test_stage_switches_inside_a_generator(self):
+        # As in build(): iter_feed_batches enables the iter_links profile from its own frame, so
+        # under that profile next() and iter_raw_links_csv only have each other as callers
+        def run(csv_path):
+            dedup = gs.make_dedup("set")
+            for urls, _ in gs.iter_feed_batches(csv_path, chunksize=2000):
+                gs.profile_stage("dedup")
+                dedup.new_indices(urls)
+            gs.profile_stage(None)
+        total_tt, collapsed_us, stacks = self.profile(run)
+        self.assertAlmostEqual(collapsed_us / 1e6, total_tt, delta=1e-6 * len(stacks) + 1e-4)
+        self.assertTrue(any(s.startswith("[iter_links]") and "iter_raw_links_csv" in s for s in stacks))
+        self.assertTrue(any(s.startswith("[dedup]") and "new_indices" in s for s in stacks))
+
+    def test_recursion(self):
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+        total_tt, collapsed_us, stacks = self.profile(lambda csv_path: fib(18))
+        self.assertAlmostEqual(collapsed_us / 1e6, total_tt, delta=1e-6 * len(stacks) + 1e-4)
+        self.assertTrue(any("fib" in s for s in stacks))
+
+
+class PipelineProfileTest(unittest.TestCase):
+    # --pipeline runs build() on a worker thread; its stages must show up in the profile rather
+    # than the main thread's event loop
+    def stage_counts(self, kind):
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = os.path.join(tmp, "feed.csv")
+            with open(csv_path, "w", encoding="utf-8") as f:
+                f.write("id,link\n" + "".join(f"{i},https://www.leeladiamond.com/products/ring-{i}?v={i % 7}\n"
+                                              for i in range(60000)))
+            prefix = os.path.join(tmp, "profile")
+            run_main("--csv", csv_path, "--outdir", os.path.join(tmp, "out"), "--public-base-url", BASE_URL,
+                     "--per-file", "5000", "--pipeline", "--upload", os.path.join(tmp, "remote"),
+                     "--profile", kind, "--profile-out", prefix, "--profile-interval", "0.5")
+            counts = collections.Counter()
+            with open(prefix + ".collapsed", encoding="utf-8") as f:
+                for line in f:
+                    stack, count = line.rsplit(" ", 1)
+                    counts[stack.split(";", 1)[0]] += int(count)
+            return counts
+
+    def assert_build_stages(self, counts):
+        for stage in ("[iter_links]", "[dedup]", "[write_urlset_xml]"):
+            self.assertGreater(counts[stage], 0, stage)
+        self.assertLess(counts["[other]"], (sum(counts.values()) - counts["[other]"]) / 2)
+
+    def test_cprofile(self):
+        self.assert_build_stages(self.stage_counts("cprofile"))
+
+    def test_sample(self):
+        self.assert_build_stages(self.stage_counts("sample"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+import generate_sitemaps as gs
+from helpers import start_purge_server
+
+
+class CloudflarePurgerTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.endpoint = start_purge_server(self)
+        self.sleeps = []
+        patcher = mock.patch.object(gs.time, "sleep", self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def purger(self, **kwargs):
+        purger = gs.CloudflarePurger("zone1", "secret", self.endpoint, **kwargs)
+        self.addCleanup(purger.close)
+        return purger
+
+    def test_batches(self):
+        urls = [f"https://www.leeladiamond.com/sitemaps/sitemap-{i:05d}.xml" for i in range(65)]
+        purger = self.purger(batch=30)
+        self.assertEqual(purger.purge(urls), 3)
+        self.assertEqual([len(r["files"]) for r in self.server.requests], [30, 30, 5])
+        self.assertEqual([f for r in self.server.requests for f in r["files"]], urls)
+        self.assertEqual({r["path"] for r in self.server.requests}, {"/client/v4/zones/zone1/purge_cache"})
+        self.assertEqual({r["auth"] for r in self.server.requests}, {"Bearer secret"})
+        self.assertEqual(purger.requests, 3)
+        self.assertEqual(self.sleeps, [])
+
+    def test_retries_429_and_5xx_honouring_retry_after(self):
+        self.server.script = [(429, {"Retry-After": "7"}), (503, {}), (502, {"Retry-After": "0"})]
+        purger = self.purger(backoff=0.5)
+        self.assertEqual(purger.purge(["https://www.leeladiamond.com/sitemaps/a.xml"]), 1)
+        self.assertEqual(purger.requests, 4)
+        # Retry-After wins when longer than the exponential backoff (0.5, 1, 2 s)
+        self.assertEqual(self.sleeps, [7, 1.0, 2.0])
+        self.assertEqual(len({tuple(r["files"]) for r in self.server.requests}), 1)
+
+    def test_fails_after_retries_run_out(self):
+        self.server.script = [(500, {})] * 3
+        purger = self.purger(retries=2, backoff=0.1)
+        with self.assertRaisesRegex(RuntimeError, "after 2 retries"):
+            purger.purge(["https://www.leeladiamond.com/sitemaps/a.xml"])
+        self.assertEqual(purger.requests, 3)
+        self.assertEqual(self.sleeps, [0.1, 0.2])
+
+    def test_client_error_is_not_retried(self):
+        self.server.script = [(403, {})]
+        with self.assertRaisesRegex(RuntimeError, "403"):
+            self.purger().purge(["https://www.leeladiamond.com/sitemaps/a.xml"])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self.sleeps, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
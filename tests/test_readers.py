@@ -0,0 +1,95 @@
+import os, tempfile, unittest
+import generate_sitemaps as gs
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+FEED = (
+    "id,title,link,price\n"
+    "1,Ring,https://www.leeladiamond.com/products/ring-1,10\n"
+    "2,NA link,NA,11\n"
+    "3,N/A link,N/A,12\n"
+    "4,null link,null,13\n"
+    "5,Blank link,,14\n"
+    "6,Padded NA,  NA ,15\n"
+    "7,Variant,http://leeladiamond.com/products/ring-1#reviews,16\n"
+    '8,"Quoted, ""multi""\nline",https://www.leeladiamond.com/products/ring-8?a=1&b=2,17\n'
+    "9,Other tokens,<NA>,18\n"
+    "10,Other tokens,nan,19\n"
+    "11,Other tokens,None,20\n"
+    "12,Fragment only,#N/A,21\n"
+    "13,Short row\n"
+    "14,Ring,HTTPS://WWW.LEELADIAMOND.COM/products/ring-14,22\n"
+    "15,Relative,/products/ring-15,23\n"
+)
+EXPECTED = [
+    "https://www.leeladiamond.com/products/ring-1",
+    "https://www.leeladiamond.com/products/ring-8?a=1&b=2",
+    "https://WWW.LEELADIAMOND.COM/products/ring-14",  # the host match is case-sensitive
+    "/products/ring-15",
+]
+
+
+def readers():
+    return [r for r in gs.READERS if {"pandas": pandas, "pyarrow": pyarrow}.get(r, True) is not None]
+
+
+class ReaderAgreementTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "feed.csv")
+        with open(self.path, "w", encoding="utf-8", newline="") as f:
+            f.write(FEED)
+
+    def deduped(self, **kwargs):
+        # First occurrences, as the dedup step sees them (pyarrow already drops in-batch repeats)
+        return list(dict.fromkeys(url for urls, _ in gs.iter_feed_batches(self.path, **kwargs) for url in urls))
+
+    def test_readers_agree_and_drop_null_links(self):
+        for reader in readers():
+            with self.subTest(reader=reader):
+                self.assertEqual(self.deduped(reader=reader), EXPECTED)
+
+    def test_readers_agree_with_extra_columns(self):
+        for reader in readers():
+            with self.subTest(reader=reader):
+                batches = list(gs.iter_feed_batches(self.path, reader=reader, extra_cols=["price"]))
+                urls = [u for b, _ in batches for u in b]
+                prices = [p for _, (col,) in batches for p in col]
+                self.assertEqual(list(dict.fromkeys(urls)), EXPECTED)
+                self.assertEqual(prices, ["10", "16", "17", "22", "23"])
+
+    def test_parallel_ranges_drop_null_links(self):
+        self.assertEqual(self.deduped(parse_workers=2), EXPECTED)
+
+    def test_parallel_ranges_report_normalize_counts(self):
+        # Worker processes' normalize counters and time reach the parent's stats (--stats-json)
+        counted = {}
+        for workers in (1, 2):
+            stats, before = gs.RunStats(), gs.normalize_counts()
+            list(gs.iter_feed_batches(self.path, stats=stats, parse_workers=workers))
+            after = gs.normalize_counts()
+            counted[workers] = {k: after[k] - before[k] for k in ("canonical", "fallback")}
+            self.assertIn("normalize", stats.stages)
+            self.assertEqual(stats.counters["rows_read"], 15)
+        self.assertGreater(counted[2]["canonical"], 0)
+        self.assertEqual(counted[2], counted[1])
+
+    def test_null_links_are_counted(self):
+        for reader in readers():
+            with self.subTest(reader=reader):
+                stats = gs.RunStats()
+                list(gs.iter_feed_batches(self.path, reader=reader, stats=stats))
+                self.assertEqual(stats.counters["rows_read"], 15)
+                self.assertEqual(stats.counters["null_links"], 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
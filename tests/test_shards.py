@@ -0,0 +1,88 @@
+import contextlib, io, os, re, tempfile, unittest
+import generate_sitemaps as gs
+from helpers import BASE_URL, run_main
+
+URLS = [f"https://www.leeladiamond.com/products/ring-{i}" for i in range(2500)]
+
+
+def locs(path):
+    with open(path, encoding="utf-8") as f:
+        return re.findall(r"<loc>(.*?)</loc>", f.read())
+
+
+class ShardFilterTest(unittest.TestCase):
+    def test_partitions_urls(self):
+        extras = [[str(i) for i in range(len(URLS))]]
+        shards = [gs.shard_filter(URLS, extras, (i, 3)) for i in range(3)]
+        self.assertEqual(sorted(u for urls, _ in shards for u in urls), sorted(URLS))
+        for urls, (col,) in shards:
+            self.assertTrue(urls)
+            # extra columns stay aligned with their URL
+            self.assertEqual([URLS[int(i)] for i in col], urls)
+
+    def test_same_url_same_shard(self):
+        urls, _ = gs.shard_filter(URLS[:10] * 2, [], (0, 2))
+        self.assertEqual(len(urls) % 2, 0)
+        self.assertEqual(urls[:len(urls) // 2], urls[len(urls) // 2:])
+
+    def test_single_shard_keeps_everything(self):
+        self.assertEqual(gs.shard_filter(URLS, [], (0, 1)), (URLS, []))
+
+
+class ShardBuildTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.csv = os.path.join(self.tmp.name, "feed.csv")
+        with open(self.csv, "w", encoding="utf-8") as f:
+            f.write("id,link\n" + "".join(f"{i},{u}\n" for i, u in enumerate(URLS + URLS[:500])))
+
+    def build_shard(self, i, count, *extra, root="run"):
+        # Shards build into ROOT/o/sI (so they share ROOT/o for the default upload manifest) and
+        # upload to the same ROOT/remote prefix
+        outdir = os.path.join(self.tmp.name, root, "o", f"s{i}")
+        out = run_main("--csv", self.csv, "--outdir", outdir, "--public-base-url", BASE_URL, "--per-file", "500",
+                       "--shard", f"{i}/{count}", "--upload", os.path.join(self.tmp.name, root, "remote"), *extra)
+        return outdir, out
+
+    def test_shards_share_an_upload_prefix(self):
+        for root, extra in (("upload", ()), ("pipeline", ("--pipeline",))):
+            with self.subTest(root):
+                outdirs = []
+                for i in range(2):
+                    outdir, out = self.build_shard(i, 2, *extra, root=root)
+                    outdirs.append(outdir)
+                    self.assertRegex(out, r" 0 deleted")
+                published = set(os.listdir(os.path.join(self.tmp.name, root, "remote")))
+                for i, outdir in enumerate(outdirs):
+                    parts = [n for n in os.listdir(outdir) if n.startswith(f"sitemap-shard{i}-")]
+                    self.assertTrue(parts)
+                    self.assertLessEqual(set(parts), published)
+                    self.assertIn(gs.shard_manifest_name((i, 2)), published)
+                # re-running shard 0 deletes nothing of shard 1's
+                self.assertRegex(self.build_shard(0, 2, *extra, root=root)[1], r" 0 deleted")
+                self.assertLessEqual(published, set(os.listdir(os.path.join(self.tmp.name, root, "remote"))))
+
+    def test_merge_index(self):
+        outdirs = [self.build_shard(i, 3)[0] for i in range(3)]
+        merged = os.path.join(self.tmp.name, "merged")
+        out = run_main("merge-index", *outdirs, "--outdir", merged, "--public-base-url", BASE_URL)
+        self.assertIn(f"Merged 3 shards ({len(URLS)} URLs", out)
+        parts = locs(os.path.join(merged, "sitemap-index.xml"))
+        # shard order, then part order within each shard
+        shard_of = [int(re.search(r"shard(\d+)-", p).group(1)) for p in parts]
+        self.assertEqual(shard_of, sorted(shard_of))
+        self.assertEqual(set(shard_of), {0, 1, 2})
+        urls = [u for i, p in zip(shard_of, parts) for u in locs(os.path.join(outdirs[i], p.rsplit("/", 1)[1]))]
+        self.assertEqual(sorted(urls), sorted(URLS))
+
+    def test_merge_index_needs_every_shard(self):
+        outdirs = [self.build_shard(i, 3)[0] for i in (0, 2)]
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            run_main("merge-index", *outdirs, "--outdir", self.tmp.name, "--public-base-url", BASE_URL)
+        with self.assertRaisesRegex(ValueError, r"Missing shard manifests for shards \[1\] of 3"):
+            gs.load_shard_manifests(outdirs)
+
+
+if __name__ == "__main__":
+    unittest.main()